@@ -0,0 +1,104 @@
+"""
+Benchmarks `RosterIndex` against the linear `sanitize_string` scan that the
+student pickers used to run on every query.
+
+Run with `python benchmarks/roster_index.py` from the repository root.
+"""
+
+import random
+import string
+import timeit
+
+from lugach.core.roster import RosterIndex, normalize_name
+
+ROSTER_SIZE = 5000
+QUERIES = ["a", "jo", "smi", "maría", "garcia", "elizabeth thom", "jonh", "zzz"]
+FIRST_NAMES = [
+    "James",
+    "Mary",
+    "John",
+    "Patricia",
+    "Robert",
+    "Jennifer",
+    "Michael",
+    "Linda",
+    "William",
+    "Elizabeth",
+    "José",
+    "María",
+    "Zoë",
+    "Chloé",
+    "Noah",
+]
+LAST_NAMES = [
+    "Smith",
+    "Johnson",
+    "Williams",
+    "Brown",
+    "Jones",
+    "García",
+    "Miller",
+    "Davis",
+    "Rodríguez",
+    "Martínez",
+    "Thompson",
+    "Nguyễn",
+    "Müller",
+    "O'Brien",
+]
+
+
+def make_roster(size: int, seed=0) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "id": i,
+            "name": f"{rng.choice(FIRST_NAMES)} "
+            f"{''.join(rng.choices(string.ascii_lowercase, k=2))}"
+            f"{rng.choice(LAST_NAMES).lower()}".title(),
+        }
+        for i in range(size)
+    ]
+
+
+def linear_scan(roster: list[dict], query: str) -> list[dict]:
+    sanitized_query = query.strip().lower()
+    return [
+        student
+        for student in roster
+        if sanitized_query in student["name"].strip().lower()
+    ]
+
+
+def main():
+    roster = make_roster(ROSTER_SIZE)
+
+    build_secs = (
+        timeit.timeit(
+            lambda: RosterIndex(roster, name_of=lambda student: student["name"]),
+            number=5,
+        )
+        / 5
+    )
+    print(f"Built index over {ROSTER_SIZE} students in {build_secs * 1000:.1f} ms")
+    print()
+
+    index = RosterIndex(roster, name_of=lambda student: student["name"])
+    print(f"{'query':16} {'matches':>8} {'index (us)':>12} {'scan (us)':>12}")
+    for query in QUERIES:
+        number = 200
+        index_secs = timeit.timeit(
+            lambda query=query: index.search_indices(query), number=number
+        )
+        scan_secs = timeit.timeit(
+            lambda query=query: linear_scan(roster, query), number=number
+        )
+        matches = len(index.search_indices(query))
+        print(
+            f"{normalize_name(query):16} {matches:8} "
+            f"{index_secs / number * 1e6:12.1f} {scan_secs / number * 1e6:12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Checks the attendance proportions counted from an `AttendanceMatrix`'s
+per-session records against Top Hat's own aggregate rows (the
+`weighted_correctness` / `correctness_weight` numbers that
+`get_all_th_attendance_proportions_for_course` used to report) for a real
+course.
+
+Run with `python benchmarks/th_attendance_proportions.py` from the
+repository root, with a Top Hat auth key set up.
+"""
+
+import lugach.core.thutils as thu
+
+
+def main():
+    client = thu.create_th_client()
+    course = thu.prompt_user_for_th_course(client)
+    matrix = thu.get_attendance_matrix(course, client)
+
+    mismatches = []
+    without_aggregate = 0
+    for student_id in matrix.student_ids:
+        aggregate = matrix.aggregate(student_id)
+        counted = matrix.counted_proportion(student_id)
+        if aggregate is None:
+            without_aggregate += 1
+        elif counted != aggregate:
+            mismatches.append((student_id, aggregate, counted))
+
+    print(
+        f"{len(matrix.student_ids)} students, {len(matrix.sessions)} sessions, "
+        f"{without_aggregate} without an aggregate row."
+    )
+    for student_id, aggregate, counted in mismatches:
+        print(f"    {student_id:>10}: Top Hat {aggregate}, counted {counted}")
+    print(f"{len(mismatches)} students' counted proportions differ from Top Hat's.")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmarks `TopHatClient` against the per-call `requests.get`/`requests.post`
+that `thutils` used to make, by replaying the requests of a
+`modify_attendance` session against a local stand-in for Top Hat.
+
+The stand-in counts the connections it accepts and sleeps for
+`HANDSHAKE_SECS` on each one, which approximates the TCP and TLS setup that
+every new connection to app.tophat.com costs.
+
+Run with `python benchmarks/th_connections.py` from the repository root.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+import requests
+
+from lugach.core.thutils import TopHatClient
+
+HANDSHAKE_SECS = 0.05
+STUDENTS_EDITED = 5
+RECORDS_EDITED_PER_STUDENT = 2
+COURSE_ID = 1234
+
+RESPONSES = {
+    "/api/v2/courses/": {"objects": [{"course_id": COURSE_ID, "course_name": "X"}]},
+    f"/api/v3/course/{COURSE_ID}/students/": [
+        {"id": i, "name": f"Student {i}"} for i in range(200)
+    ],
+    f"/api/v3/course/{COURSE_ID}/gradeable_course_items_aggregated/": [
+        {"id": i, "name": f"2025-01-{i:02} 10:00", "type": "attendance"}
+        for i in range(1, 29)
+    ],
+    f"/api/gradebook/v1/gradeable_items/{COURSE_ID}/": {
+        "results": [
+            {"item_id": str(i), "weighted_correctness": 1, "grade_type": "graded"}
+            for i in range(1, 29)
+        ],
+        "next": None,
+    },
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StandInHandler.lock:
+            StandInHandler.connections += 1
+        time.sleep(HANDSHAKE_SECS)
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+
+        path = self.path.split("?")[0]
+        body = json.dumps(RESPONSES.get(path, {})).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def modify_attendance_session() -> list[tuple[str, str]]:
+    """
+    The (method, path) of every request `modify_attendance` makes to edit
+    `RECORDS_EDITED_PER_STUDENT` records for each of `STUDENTS_EDITED`
+    students.
+    """
+    calls = [
+        ("GET", "/api/v2/courses/"),
+        ("GET", f"/api/v3/course/{COURSE_ID}/students/"),
+    ]
+    for _ in range(STUDENTS_EDITED):
+        for record_id in range(1, RECORDS_EDITED_PER_STUDENT + 1):
+            calls += [
+                (
+                    "GET",
+                    f"/api/v3/course/{COURSE_ID}/gradeable_course_items_aggregated/",
+                ),
+                ("GET", f"/api/gradebook/v1/gradeable_items/{COURSE_ID}/"),
+                (
+                    "POST",
+                    f"/api/gradebook/v1/gradeable_items/{COURSE_ID}/edit/{record_id}/",
+                ),
+            ]
+
+    return calls
+
+
+def run_per_call(base_url: str, calls: list[tuple[str, str]]) -> None:
+    for method, path in calls:
+        requests.request(method, urljoin(base_url, path), json={}).json()
+
+
+def run_client(base_url: str, calls: list[tuple[str, str]]) -> None:
+    client = TopHatClient(base_url=base_url)
+    for method, path in calls:
+        client.request(method, path, json={}).json()
+    client.close()
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    calls = modify_attendance_session()
+    print(
+        f"Replaying {len(calls)} requests ({HANDSHAKE_SECS * 1000:.0f}ms per handshake)"
+    )
+    print(f"{'client':>12} | {'connections':>11} | {'total':>8} | {'per request':>11}")
+
+    for name, run in [("per-call", run_per_call), ("TopHatClient", run_client)]:
+        StandInHandler.connections = 0
+        start = time.perf_counter()
+        run(base_url, calls)
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{name:>12} | {StandInHandler.connections:>11} | "
+            f"{elapsed:>7.2f}s | {elapsed / len(calls) * 1000:>9.1f}ms"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import importlib
 import traceback as tb
 
+from canvasapi.exceptions import InvalidAccessToken
+
+import lugach.core.cvutils as cvu
+
 """
 Edit this variable to enable/disable applications in LUGACH.
 Two applications are commented out by default; these make
@@ -11,16 +15,17 @@ awareness that they may not be working.
 """
 app_names_and_descriptions = {
     "setup": "Setup secret variables necessary for the other applications.",
-    "identify_absent_students": "Identify students who have missed an excessive number of classes.",
+    "identify_absent_students": "Identify students who have missed an excessive number of classes in one or every course.",
     "identify_quiz_concerns": "Notify students who have failed to complete an excessive number of quizzes.",
-    "modify_due_dates": "Change due dates for a given student and assignment.",
-    "modify_time_limits": "Add percent time to all quizzes for a given student.",
+    "modify_due_dates": "Change due dates for given students and assignments.",
+    "shift_due_dates": "Move every due date in a date window by a number of days.",
+    "modify_time_limits": "Add percent time to all quizzes for a given student or a CSV of students.",
     # "post_final_grades": "Post final grades for all students in a class.",
     "search_student_by_name": "Search all classes for a given student.",
     # "update_attendance_verification": "Complete attendance verification in Lighthouse.",
-    "modify_attendance": "Change attendance records for students in Top Hat.",
-    "take_attendance": "Take and monitor attendance in Top Hat.",
-    "get_grades": "View a student's grades in Canvas.",
+    "modify_attendance": "Change attendance records in Top Hat, one at a time or in bulk.",
+    "take_attendance": "Take attendance in Top Hat with a live, self-refreshing count.",
+    "get_grades": "View grades in Canvas for one or more students side by side.",
 }
 
 
@@ -61,5 +66,8 @@ def run_app_from_app_name(app_name: str):
     except (KeyboardInterrupt, EOFError):
         print()
         print("Application terminated.")
+    except InvalidAccessToken as e:
+        cvu.invalidate_canvas_session()
+        handle_exception(e)
     except Exception as e:
         handle_exception(e)
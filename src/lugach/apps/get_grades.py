@@ -1,34 +1,113 @@
+from canvasapi.assignment import Assignment
+from canvasapi.course import Course
+from canvasapi.submission import Submission
+from canvasapi.user import User
+
+import lugach.core.constants as cs
+import lugach.core.cvstore as cvstore
 import lugach.core.cvutils as cvu
 
+COLUMN_WIDTH = 13
+
+
+def get_assignments_and_submissions(
+    course: Course, students: list[User]
+) -> tuple[list[Assignment], dict[tuple[int, int], Submission]]:
+    """
+    Collects the assignments in a course and the given students' submissions
+    to them, keyed by `(assignment_id, user_id)`. Over the network this is a
+    single submissions stream with each submission's assignment embedded.
+    """
+    student_ids = [student.id for student in students]
+
+    if cs.USE_CANVAS_STORE:
+        assignments = cvstore.get_assignments(course)
+        submissions = cvstore.get_submissions(course, user_ids=student_ids)
+    else:
+        submissions = list(
+            course.get_multiple_submissions(
+                student_ids=student_ids, include=["assignment"]
+            )
+        )
+        assignments_by_id = {
+            submission.assignment["id"]: Assignment(
+                course._requester, {"course_id": course.id, **submission.assignment}
+            )
+            for submission in submissions
+        }
+        assignments = sorted(
+            assignments_by_id.values(),
+            key=lambda assignment: (assignment.due_at is None, assignment.due_at or ""),
+        )
+
+    submissions_by_key = {
+        (submission.assignment_id, submission.user_id): submission
+        for submission in submissions
+    }
+    return assignments, submissions_by_key
+
+
+def prompt_for_students(course: Course) -> list[User]:
+    roster_index = cvu.get_student_roster_index(course, use_store=cs.USE_CANVAS_STORE)
+    students = {}
+    while True:
+        student = cvu.prompt_for_student(course, roster_index=roster_index)
+        students[student.id] = student
+
+        print()
+        add_another = input("Would you like to compare another student (y/n)? ")
+        if add_another != "y":
+            return list(students.values())
+
+
+def format_score(score: float | None, points_possible: float | None) -> str:
+    points_possible = points_possible or 0
+    score_str = "----" if score is None else f"{score:4.0f}"
+    return f"{score_str} / {points_possible:<4.0f}".ljust(COLUMN_WIDTH)
+
 
 def main():
     canvas = cvu.create_canvas_object()
-    course = cvu.prompt_for_course(canvas)
-    student = cvu.prompt_for_student(course)
+    course = cvu.prompt_for_course(canvas, use_store=cs.USE_CANVAS_STORE)
+    students = prompt_for_students(course)
 
-    assignments = course.get_assignments(order_by="due_at")
+    assignments, submissions = get_assignments_and_submissions(course, students)
 
     print()
-    print(f"Grades for {student.name} in {course.name}:")
+    print(
+        f"Grades for {', '.join(student.name for student in students)} in {course.name}:"
+    )
     print()
 
-    total_score = 0
-    total_points = 0
+    header = " | ".join(
+        f"{student.name:{COLUMN_WIDTH}.{COLUMN_WIDTH}}" for student in students
+    )
+    print(f"{'Assignment':30} | {header}")
+    print("-" * (33 + len(header)))
+
+    total_scores = {student.id: 0 for student in students}
+    total_points = {student.id: 0 for student in students}
     for assignment in assignments:
-        submission = assignment.get_submission(student.id)
+        columns = []
+        for student in students:
+            submission = submissions.get((assignment.id, student.id))
 
-        if submission and submission.workflow_state == "graded":
-            print(
-                f"{assignment.name:30.30} | {submission.score:4.0f} / {assignment.points_possible:<4.0f}"
-            )
-            total_score += submission.score
-            total_points += assignment.points_possible
-        else:
-            print(
-                f"{assignment.name:30.30} | ---- / {assignment.points_possible:<4.0f}"
-            )
+            if submission and submission.workflow_state == "graded":
+                columns.append(
+                    format_score(submission.score, assignment.points_possible)
+                )
+                total_scores[student.id] += submission.score or 0
+                total_points[student.id] += assignment.points_possible or 0
+            else:
+                columns.append(format_score(None, assignment.points_possible))
+
+        print(f"{assignment.name:30.30} | {' | '.join(columns)}")
 
-    print("----------------------------------------------")
-    print(f"{'Total':<30} | {total_score:4.0f} / {total_points:<4.0f}")
+    print("-" * (33 + len(header)))
+    totals = " | ".join(
+        format_score(total_scores[student.id], total_points[student.id])
+        for student in students
+    )
+    print(f"{'Total':<30} | {totals}")
     print()
     input("Press ENTER to continue.")
@@ -1,35 +1,16 @@
 import lugach.core.thutils as thu
-
-
-def _find_student_by_id(
-    students: list[thu.Student], desired_student_id: int
-) -> dict | None:
-    for student in students:
-        current_student_id = student["id"]
-        if desired_student_id == current_student_id:
-            return student
+from lugach.core.fanout import FanOutResult, fan_out
 
 
 def get_tolerance_groups(
-    auth_header: thu.AuthHeader, course: thu.Course, tolerance: int
+    client: thu.TopHatClient, course: thu.Course, tolerance: int
 ) -> tuple[dict, dict]:
-    students = thu.get_th_students(auth_header, course)
-    attendance_proportions = thu.get_all_th_attendance_proportions_for_course(
-        course, auth_header
-    )
-
     students_under_tolerance = {}
     students_at_tolerance = {}
-    for student_id, (attended, total) in attendance_proportions.items():
-        classes_missed = total - attended
+    for student, classes_missed in thu.get_th_absence_counts(client, course):
         if classes_missed < tolerance - 1:
             continue
 
-        student = _find_student_by_id(students, student_id)
-        if not student:
-            print(f"Could not find student with id {student_id}")
-            continue
-
         name = student["name"]
         if classes_missed == tolerance - 1:
             students_under_tolerance[name] = classes_missed
@@ -39,17 +20,24 @@ def get_tolerance_groups(
     return (students_under_tolerance, students_at_tolerance)
 
 
-def main():
-    auth_header = thu.get_auth_header_for_session()
-    course = thu.prompt_user_for_th_course(auth_header)
-    tolerance = int(
-        input("Enter the max number of absences for the course (generally 4): ")
+def get_tolerance_groups_for_all_courses(
+    client: thu.TopHatClient, tolerance: int
+) -> list[FanOutResult]:
+    """
+    Runs `get_tolerance_groups` for every Top Hat course at once. Each
+    result's `item` is the course and its `value` is the pair of groups.
+    """
+    courses = list(thu.get_th_courses(client))
+    return fan_out(
+        courses,
+        lambda course: get_tolerance_groups(client, course, tolerance),
+        timeout=None,
     )
 
-    students_under_tolerance, students_at_tolerance = get_tolerance_groups(
-        auth_header, course, tolerance
-    )
 
+def print_tolerance_groups(
+    students_under_tolerance: dict, students_at_tolerance: dict, tolerance: int
+) -> None:
     s = "" if tolerance - 1 == 1 else "s"
     print()
     print(f"Here are all the students with {tolerance - 1} absence{s}: ")
@@ -62,5 +50,50 @@ def main():
     for student, absences in students_at_tolerance.items():
         print(f"    {student}: {absences}")
 
+
+def print_all_courses_report(results: list[FanOutResult], tolerance: int) -> None:
+    students_under_tolerance = {}
+    students_at_tolerance = {}
+
+    print()
+    for result in results:
+        course_name = result.item["course_name"]
+        if result.error:
+            print(f"    {course_name:40.40} | failed ({result.error})")
+            continue
+
+        under_tolerance, at_tolerance = result.value
+        print(
+            f"    {course_name:40.40} | {len(under_tolerance):3} near, "
+            f"{len(at_tolerance):3} at or over the limit ({result.elapsed:.2f}s)"
+        )
+
+        for name, absences in under_tolerance.items():
+            students_under_tolerance[f"{name} ({course_name})"] = absences
+        for name, absences in at_tolerance.items():
+            students_at_tolerance[f"{name} ({course_name})"] = absences
+
+    print_tolerance_groups(students_under_tolerance, students_at_tolerance, tolerance)
+
+
+def main():
+    client = thu.create_th_client()
+    all_courses = input("Check every Top Hat course at once (y/n)? ")
+    course = None if all_courses == "y" else thu.prompt_user_for_th_course(client)
+    tolerance = int(
+        input("Enter the max number of absences for the course (generally 4): ")
+    )
+
+    if course:
+        students_under_tolerance, students_at_tolerance = get_tolerance_groups(
+            client, course, tolerance
+        )
+        print_tolerance_groups(
+            students_under_tolerance, students_at_tolerance, tolerance
+        )
+    else:
+        results = get_tolerance_groups_for_all_courses(client, tolerance)
+        print_all_courses_report(results, tolerance)
+
     print()
     input("Press ENTER to quit.")
@@ -1,38 +1,204 @@
+from canvasapi.assignment import Assignment
 from canvasapi.canvas import Course
 from canvasapi.user import User
 import lugach.core.constants as cs
+import lugach.core.cvstore as cvstore
 import lugach.core.cvutils as cvu
+import lugach.core.messaging as messaging
+from lugach.core.fanout import fan_out
 
-from itertools import batched
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from dateutil.parser import parse
 
 
-def find_quiz_concern_students(course: Course) -> dict[User, bool]:
-    student_ids = [
-        student.id for student in course.get_users(enrollment_type="student")
-    ]
+def find_quiz_concern_students_in_store(course: Course) -> dict[User, bool]:
+    students = cvstore.get_users(course)
     quiz_ids = [
         assn.id
-        for assn in course.get_assignments(bucket="past", order_by="due_at")
+        for assn in cvstore.get_assignments(course)
         if "online_quiz" in assn.submission_types
+        and assn.due_at
+        and parse(assn.due_at) < datetime.now(timezone.utc)
     ]
+    submissions = cvstore.get_submissions(course, assignment_ids=quiz_ids)
+
+    missed_quizzes = Counter(
+        submission.user_id
+        for submission in submissions
+        if cvstore.is_missing(submission)
+    )
 
     quiz_concern_students = {}
+    for student in students:
+        if missed_quizzes[student.id] >= cs.QUIZ_CONCERN_TOLERANCE:
+            student.missed_quizzes = missed_quizzes[student.id]
+            quiz_concern_students[student] = False
+
+    return quiz_concern_students
+
+
+def _max_batch_size_for_url(
+    course: Course, student_ids: list[int], quiz_ids: list[int]
+) -> int:
+    """
+    Returns the most students that fit in one submissions request without
+    the URL growing past `cs.MAX_URL_LENGTH`, or 0 if the quiz ids alone
+    leave no room for even one student.
+    """
+    base_url = f"{course._requester.base_url}courses/{course.id}/students/submissions?grouped=True"
+    quiz_params_length = sum(len(f"&assignment_ids%5B%5D={id}") for id in quiz_ids)
+    student_param_length = max(len(f"&student_ids%5B%5D={id}") for id in student_ids)
+
+    available_length = cs.MAX_URL_LENGTH - len(base_url) - quiz_params_length
+    return max(0, available_length // student_param_length)
+
+
+def _count_missed_quizzes_per_quiz(
+    course: Course, student_ids: list[int], quiz_ids: list[int]
+) -> dict[int, int]:
+    """
+    Counts each student's missed quizzes with one submissions request per
+    quiz, for courses with too many quizzes to list in a single URL.
+    """
+    enrolled_ids = set(student_ids)
+    results = fan_out(
+        quiz_ids,
+        lambda quiz_id: [
+            submission.user_id
+            for submission in Assignment(
+                course._requester, {"id": quiz_id, "course_id": course.id}
+            ).get_submissions(per_page=cs.CANVAS_PER_PAGE)
+            if submission.missing and submission.user_id in enrolled_ids
+        ],
+        timeout=None,
+    )
+
+    missed_quizzes = Counter()
+    for result in results:
+        if result.error:
+            raise result.error
+
+        missed_quizzes.update(result.value)
+
+    return {
+        student_id: count
+        for student_id, count in missed_quizzes.items()
+        if count >= cs.QUIZ_CONCERN_TOLERANCE
+    }
+
+
+def _next_batch_size(batch_size: int, elapsed: float, max_batch_size: int) -> int:
+    if elapsed > cs.TARGET_BATCH_SECS:
+        return max(1, batch_size // 2)
+    if elapsed < cs.TARGET_BATCH_SECS / 2:
+        return min(max_batch_size, batch_size + batch_size // 2 + 1)
+
+    return batch_size
+
+
+def _count_missed_quizzes_in_batch(
+    course: Course, student_ids: list[int], quiz_ids: list[int]
+) -> tuple[dict[int, int], float]:
+    start = time.perf_counter()
+    student_groups = course.get_multiple_submissions(
+        student_ids=student_ids, assignment_ids=quiz_ids, grouped=True
+    )
+
+    missed_quizzes = {}
+    for student_group in student_groups:
+        missed_assignments = [
+            submission.missing for submission in student_group.submissions
+        ]
+
+        if missed_assignments.count(True) >= cs.QUIZ_CONCERN_TOLERANCE:
+            missed_quizzes[student_group.user_id] = missed_assignments.count(True)
 
-    for i, batch in enumerate(batched(student_ids, cs.CHUNK_SIZE)):
-        print(f"Checking students ({i * cs.CHUNK_SIZE} so far)...")
-        student_groups = course.get_multiple_submissions(
-            student_ids=batch, assignment_ids=quiz_ids, grouped=True
+    return missed_quizzes, time.perf_counter() - start
+
+
+def _count_missed_quizzes_in_batches(
+    course: Course, student_ids: list[int], quiz_ids: list[int], max_batch_size: int
+) -> tuple[dict[int, int], int]:
+    """
+    Counts each student's missed quizzes with batched submissions requests,
+    sizing each batch by how long the last one took. Returns the counts and
+    the number of batches.
+    """
+    pending = deque(student_ids)
+    batch_size = min(cs.CHUNK_SIZE, max_batch_size)
+
+    missed_quizzes = {}
+    checked = 0
+    batches = 0
+    with ThreadPoolExecutor(max_workers=cs.MAX_WORKERS) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < cs.MAX_WORKERS:
+                batch = [
+                    pending.popleft() for _ in range(min(batch_size, len(pending)))
+                ]
+                future = executor.submit(
+                    _count_missed_quizzes_in_batch, course, batch, quiz_ids
+                )
+                running[future] = len(batch)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                checked += running.pop(future)
+                batches += 1
+
+                batch_missed_quizzes, elapsed = future.result()
+                missed_quizzes.update(batch_missed_quizzes)
+                batch_size = _next_batch_size(batch_size, elapsed, max_batch_size)
+
+            print(f"Checking students ({checked} of {len(student_ids)} so far)...")
+
+    return missed_quizzes, batches
+
+
+def find_quiz_concern_students(course: Course, use_store=False) -> dict[User, bool]:
+    if use_store:
+        return find_quiz_concern_students_in_store(course)
+
+    start = time.perf_counter()
+    with cvu.count_requests(course) as counter:
+        students = list(
+            cvu.iter_prefetched(course.get_users(enrollment_type="student"))
         )
+        quiz_ids = [
+            assn.id
+            for assn in course.get_assignments(bucket="past", order_by="due_at")
+            if "online_quiz" in assn.submission_types
+        ]
+        if not students or not quiz_ids:
+            return {}
 
-        for student_group in student_groups:
-            missed_assignments = [
-                submission.missing for submission in student_group.submissions
-            ]
+        student_ids = [student.id for student in students]
+        max_batch_size = _max_batch_size_for_url(course, student_ids, quiz_ids)
+        if max_batch_size:
+            missed_quizzes, batches = _count_missed_quizzes_in_batches(
+                course, student_ids, quiz_ids, max_batch_size
+            )
+        else:
+            print(f"Too many quizzes to batch; checking {len(quiz_ids)} one by one...")
+            missed_quizzes = _count_missed_quizzes_per_quiz(
+                course, student_ids, quiz_ids
+            )
+            batches = len(quiz_ids)
 
-            if missed_assignments.count(True) >= cs.QUIZ_CONCERN_TOLERANCE:
-                submission = student_group.submissions[0]
-                student = course.get_user(submission.user_id)
-                quiz_concern_students[student] = False
+    print(
+        f"Checked {len(students)} students in {batches} batches "
+        f"({counter['requests']} requests, {time.perf_counter() - start:.2f}s)."
+    )
+
+    quiz_concern_students = {}
+    for student in students:
+        if student.id in missed_quizzes:
+            student.missed_quizzes = missed_quizzes[student.id]
+            quiz_concern_students[student] = False
 
     return quiz_concern_students
 
@@ -78,16 +244,33 @@ def confirm_students_for_msg(
 
 def send_msg(quiz_concern_students, instructor_name, canvas, course):
     quiz_concern_students = confirm_students_for_msg(quiz_concern_students)
-    subject = cs.QUIZ_CONCERN_SUBJECT.format(course_name=course.name)
-    body = cs.QUIZ_CONCERN_BODY.format(instructor_name=instructor_name)
+    selected_students = [
+        student for student, selected in quiz_concern_students.items() if selected
+    ]
+    if not selected_students:
+        print("No students were selected.")
+        return
+
+    def fields_for(student):
+        return {
+            "course_name": course.name,
+            "instructor_name": instructor_name,
+            "student_name": student.name,
+            "missed_quizzes": student.missed_quizzes,
+        }
+
+    messages = messaging.render_messages(
+        selected_students, cs.QUIZ_CONCERN_SUBJECT, cs.QUIZ_CONCERN_BODY, fields_for
+    )
 
     print("------MESSAGE------")
     print()
-    print(f"{subject}")
+    print(f"{messages[0].subject}")
     print()
-    print(f"{body}")
+    print(f"{messages[0].body}")
     print()
     print("-------------------")
+    print(f"(Personalized for each of the {len(selected_students)} selected students.)")
     print_selected_students(quiz_concern_students)
 
     final_confirmation = input(
@@ -96,25 +279,21 @@ def send_msg(quiz_concern_students, instructor_name, canvas, course):
     if final_confirmation != "y":
         return
 
-    canvas.create_conversation(
-        recipients=[student.id for student in quiz_concern_students],
-        subject=subject,
-        body=body,
-        context_code=f"course_{course.id}",
-    )
-    print("Message sent!")
+    messaging.send_messages(canvas, messages, context_code=f"course_{course.id}")
 
 
 def main():
     canvas = cvu.create_canvas_object()
-    course = cvu.prompt_for_course(canvas)
+    course = cvu.prompt_for_course(canvas, use_store=cs.USE_CANVAS_STORE)
     print()
     instructor_name = input(
         "Enter your name (this will go in the signature of the email): "
     )
     print()
 
-    quiz_concern_students = find_quiz_concern_students(course)
+    quiz_concern_students = find_quiz_concern_students(
+        course, use_store=cs.USE_CANVAS_STORE
+    )
 
     if len(quiz_concern_students) == 0:
         print("No students need quiz concern emails sent!")
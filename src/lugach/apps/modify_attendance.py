@@ -1,4 +1,21 @@
+"""
+Changes attendance records for students in a Top Hat course.
+
+Records can be edited one at a time, or in bulk: either from a CSV file with
+`student`, `date`, and `option` columns (where `student` is the student's
+name, email, Top Hat id, or LU id and `option` is present, absent, or
+excused), or for every session in a date range for a set of students.
+"""
+
+import csv
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+
+from dateutil.parser import ParserError, parse
+
 import lugach.core.thutils as thu
+from lugach.core.roster import normalize_name
 
 
 def convert_attendance_record_to_str(attendance_record: dict):
@@ -36,40 +53,169 @@ def prompt_user_for_attendance_record_to_edit(attendance_records: list[dict]) ->
     return chosen_record
 
 
+def parse_attendance_option(choice: str) -> thu.AttendanceOptions | None:
+    choice = choice.strip().lower()
+    if choice == "p" or choice == "present":
+        return thu.AttendanceOptions.PRESENT
+    elif choice == "a" or choice == "absent":
+        return thu.AttendanceOptions.ABSENT
+    elif choice == "e" or choice == "excused":
+        return thu.AttendanceOptions.EXCUSED
+
+    return None
+
+
 def prompt_user_for_attendance_option() -> thu.AttendanceOptions:
     while True:
         choice = input(
             "Would you like to mark the student as (p)resent, (e)xcused, or (a)bsent?"
         )
-        if choice not in ["p", "e", "a", "present", "excused", "absent"]:
+        attendance_option = parse_attendance_option(choice)
+        if not attendance_option:
             print("Invalid choice. Try again.")
             continue
 
-        break
+        return attendance_option
+
+
+def read_attendance_edits_csv(path: Path) -> list[tuple[str, str, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            (row["student"].strip(), row["date"].strip(), row["option"])
+            for row in csv.DictReader(f)
+            if row.get("student")
+        ]
+
+
+def resolve_attendance_edits(
+    course: thu.Course,
+    client: thu.TopHatClient,
+    attendance_matrix: thu.AttendanceMatrix,
+    rows: list[tuple[str, str, str]],
+) -> list[thu.AttendanceEdit]:
+    students_by_key = {}
+    for student in thu.get_th_students(client, course):
+        students_by_key[str(student["id"])] = student
+        students_by_key[normalize_name(student["name"])] = student
+        for key in ["email", "student_id"]:
+            if student.get(key):
+                students_by_key[str(student[key]).lower()] = student
+
+    session_ids_by_date = defaultdict(list)
+    for session_id, date_taken in attendance_matrix.sessions:
+        session_ids_by_date[date_taken].append(session_id)
+
+    edits = []
+    for identifier, date_str, option_str in rows:
+        student = students_by_key.get(identifier.lower()) or students_by_key.get(
+            normalize_name(identifier)
+        )
+        option = parse_attendance_option(option_str)
+        try:
+            session_ids = session_ids_by_date[parse(date_str).date()]
+        except ParserError:
+            session_ids = []
 
-    attendance_option = None
+        if not student or not option or not session_ids:
+            print(f"Could not match {identifier}, {date_str}, {option_str}; skipping.")
+            continue
 
-    if choice == "p" or choice == "present":
-        attendance_option = thu.AttendanceOptions.PRESENT
-    elif choice == "a" or choice == "absent":
-        attendance_option = thu.AttendanceOptions.ABSENT
+        edits.extend(
+            thu.AttendanceEdit(student["id"], session_id, option)
+            for session_id in session_ids
+        )
+
+    return edits
+
+
+def get_date(prompt: str) -> date:
+    while True:
+        try:
+            return parse(input(prompt)).date()
+        except ParserError:
+            print("Please enter a date in the proper format.")
+
+
+def prompt_for_date_range_edits(
+    course: thu.Course,
+    client: thu.TopHatClient,
+    attendance_matrix: thu.AttendanceMatrix,
+) -> list[thu.AttendanceEdit]:
+    students = {}
+    while True:
+        student = thu.prompt_user_for_th_student(course, client)
+        students[student["id"]] = student
+
+        print()
+        add_another = input("Would you like to add another student (y/n)? ")
+        if add_another != "y":
+            break
+
+    print()
+    start = get_date("Change sessions on or after (mm-dd-YYYY): ")
+    end = get_date("...and on or before (mm-dd-YYYY): ")
+    option = prompt_user_for_attendance_option()
+
+    return [
+        thu.AttendanceEdit(student_id, session_id, option)
+        for student_id in students
+        for session_id, date_taken in attendance_matrix.sessions
+        if start <= date_taken <= end
+    ]
+
+
+def run_bulk_mode(
+    course: thu.Course,
+    client: thu.TopHatClient,
+    attendance_matrix: thu.AttendanceMatrix,
+) -> None:
+    from_csv = input("Read the changes from a CSV (y/n)? ")
+    print()
+    if from_csv == "y":
+        path = Path(input("Enter the path to the attendance CSV: ").strip())
+        rows = read_attendance_edits_csv(path)
+        edits = resolve_attendance_edits(course, client, attendance_matrix, rows)
     else:
-        attendance_option = thu.AttendanceOptions.EXCUSED
+        edits = prompt_for_date_range_edits(course, client, attendance_matrix)
 
-    return attendance_option
+    print()
+    confirm = input(
+        f"Make these {len(edits)} attendance changes in {course['course_name']} (y/n)? "
+    )
+    if confirm != "y":
+        return
+
+    results = thu.edit_attendance_in_bulk(
+        client, course["course_id"], edits, matrix=attendance_matrix
+    )
+    failures = [result for result in results if result.error]
+    for result in failures:
+        edit = result.item
+        print(
+            f"Failed to change session {edit.attendance_id} for student "
+            f"{edit.student_id}: {result.error}"
+        )
+
+    print(f"Changed {len(results) - len(failures)} of {len(results)} records.")
 
 
 def main():
-    auth_header = thu.get_auth_header_for_session()
-    course = thu.prompt_user_for_th_course(auth_header)
+    client = thu.create_th_client()
+    course = thu.prompt_user_for_th_course(client)
+    attendance_matrix = thu.get_attendance_matrix(course, client)
+
+    print()
+    bulk_mode = input("Change attendance for many students or sessions at once (y/n)? ")
+    if bulk_mode == "y":
+        print()
+        run_bulk_mode(course, client, attendance_matrix)
+        return
 
     while True:
-        student = thu.prompt_user_for_th_student(course, auth_header)
+        student = thu.prompt_user_for_th_student(course, client)
 
         while True:
-            attendance_records = thu.get_attendance_records_for_student_in_course(
-                course, student, auth_header
-            )
+            attendance_records = attendance_matrix.records_for(student["id"])
 
             chosen_record = prompt_user_for_attendance_record_to_edit(
                 attendance_records
@@ -81,8 +227,9 @@ def main():
                 student_id=student["id"],
                 attendance_id=chosen_record["id"],
                 new_attendance=new_attendance,
-                auth_header=auth_header,
+                client=client,
             )
+            attendance_matrix.set(student["id"], chosen_record["id"], new_attendance)
 
             print()
             keep_looping_records = input(
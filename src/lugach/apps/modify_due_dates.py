@@ -1,7 +1,10 @@
 import lugach.core.cvutils as cvu
 
+from canvasapi.assignment import Assignment
+from canvasapi.course import Course
+from canvasapi.user import User
 from dateutil.parser import parse
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.parser import ParserError
 
 
@@ -17,10 +20,143 @@ def get_new_due_date() -> datetime:
             print("Please enter a date in the proper format.")
 
 
+def get_new_due_date_or_shift() -> datetime | timedelta:
+    while True:
+        query = input(
+            "Type a new due date (mm-dd-YYYY) or a shift in days from each current due date (e.g. +7): "
+        ).strip()
+        try:
+            if query.startswith(("+", "-")):
+                new_due_date = timedelta(days=int(query))
+                description = f"{int(query):+} days from each current due date"
+            else:
+                new_due_date = parse(query)
+                description = str(new_due_date)
+        except (ParserError, ValueError):
+            print("Please enter a date in the proper format.")
+            continue
+
+        confirm_date = input(f"Confirm new due date as {description} (y/n)? ")
+        if confirm_date == "y":
+            return new_due_date
+
+
+def prompt_for_students(course: Course) -> list[User]:
+    roster_index = cvu.get_student_roster_index(course)
+    students = {}
+    while True:
+        student = cvu.prompt_for_student(course, roster_index=roster_index)
+        students[student.id] = student
+
+        print()
+        add_another = input("Would you like to add another student (y/n)? ")
+        if add_another != "y":
+            return list(students.values())
+
+
+def prompt_for_assignments(assignments: list[Assignment]) -> list[Assignment]:
+    print("Which assignments would you like to change?")
+    for i, assignment in enumerate(assignments, start=1):
+        print(f"{i:4}. {assignment.name}")
+    print()
+
+    while True:
+        try:
+            choices = input("Enter the indices of the assignments (e.g. 1, 4, 5): ")
+            indices = {int(choice) for choice in choices.replace(",", " ").split()}
+            if not indices or not all(1 <= i <= len(assignments) for i in indices):
+                raise ValueError
+
+            return [assignments[i - 1] for i in sorted(indices)]
+        except ValueError:
+            print("Please enter indices from the list above.")
+
+
+def run_bulk_mode(course: Course) -> None:
+    students = prompt_for_students(course)
+    print()
+
+    all_assignments = [
+        assignment for assignment in course.get_assignments() if assignment.due_at
+    ]
+    assignments = prompt_for_assignments(all_assignments)
+    due_dates = cvu.get_due_dates_by_assignment(course, assignments)
+    print()
+
+    new_due_date = get_new_due_date_or_shift()
+    time_zone = cvu.get_course_time_zone(course)
+
+    assignment_overrides = []
+    for assignment in assignments:
+        old_due_date = due_dates[assignment.id]
+        if isinstance(new_due_date, timedelta):
+            if old_due_date is None:
+                print(f"    {assignment.name:40.40} | no due date to shift; skipped")
+                continue
+
+            # Shift on the course's wall clock, as `shift_due_dates` does.
+            due_at = cvu.shift_date(
+                old_due_date.isoformat(), new_due_date.days, time_zone
+            )
+        else:
+            due_at = new_due_date.isoformat()
+
+        print(f"    {assignment.name:40.40} | {old_due_date} -> {due_at}")
+        assignment_overrides.append(
+            {
+                "assignment_id": assignment.id,
+                "student_ids": [student.id for student in students],
+                "title": f"{len(students)} students",
+                "due_at": due_at,
+                "lock_at": due_at,
+            }
+        )
+
+    if not assignment_overrides:
+        print("None of those assignments has a due date to shift.")
+        return
+
+    print()
+    confirm = input(
+        f"Create these overrides for {len(students)} students in {course.name} (y/n)? "
+    )
+    if confirm != "y":
+        return
+
+    results, skipped_student_ids = cvu.create_overrides_in_bulk(
+        course, assignment_overrides
+    )
+    for result in results:
+        if result.error:
+            print(f"Failed to create {len(result.item)} overrides: {result.error}")
+        else:
+            print(f"Created {len(result.item)} overrides in {result.elapsed:.2f}s.")
+
+    if skipped_student_ids:
+        print()
+        print("These students already had an override, which was left unchanged:")
+        names = {student.id: student.name for student in students}
+        assignment_names = {
+            assignment.id: assignment.name for assignment in assignments
+        }
+        for assignment_id, student_ids in skipped_student_ids.items():
+            skipped_names = ", ".join(names.get(id, str(id)) for id in student_ids)
+            print(f"    {assignment_names[assignment_id]:40.40} | {skipped_names}")
+
+
 def main():
     canvas = cvu.create_canvas_object()
     course = cvu.prompt_for_course(canvas)
 
+    print()
+    bulk_mode = input(
+        "Change due dates for several students and assignments at once (y/n)? "
+    )
+    if bulk_mode == "y":
+        print()
+        run_bulk_mode(course)
+        return
+
     while True:
         print()
         student = cvu.prompt_for_student(course)
@@ -1,15 +1,189 @@
 """
 A command line script that automatically applies quiz/test time limit accomodations
 for a given student in a given Canvas course.
+
+In bulk mode, the accomodations for every student are read from a CSV file
+with `student` and `percentage` columns, where `student` is the student's
+name, Canvas id, or LU id. The roster is saved after each bulk run so that it
+can be reapplied to the course later (e.g. when new quizzes are published).
 """
 
+import csv
+from collections import defaultdict
+from pathlib import Path
+
+from canvasapi.course import Course
+from canvasapi.user import User
+
 import lugach.core.cvutils as cvu
+from lugach.core.roster import normalize_name
+from lugach.core.secrets import ROOT_DIR
+
+ACCOMMODATIONS_DIR = ROOT_DIR / "accommodations"
+
+
+def _stored_accommodations_path(course: Course) -> Path:
+    return ACCOMMODATIONS_DIR / f"{course.id}.csv"
+
+
+def parse_percentage(percentage: str) -> float:
+    """
+    Reads a percentage of time to add, such as "50", "50.5" or "50%", as a
+    time multiplier. Raises ValueError if it is not a non-negative number.
+    """
+    time_multiplier = float(percentage.strip().removesuffix("%")) / 100
+    if not time_multiplier >= 0:
+        raise ValueError(f"Expected a non-negative percentage, got {percentage!r}.")
+
+    return time_multiplier
+
+
+def read_accommodations_csv(path: Path) -> list[tuple[str, float]]:
+    """
+    Reads the (student, time multiplier) rows of an accommodations CSV,
+    reporting and skipping any row whose percentage cannot be read.
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        # Line 1 is the header.
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            if not row.get("student"):
+                continue
+
+            try:
+                time_multiplier = parse_percentage(row.get("percentage") or "")
+            except ValueError:
+                print(
+                    f"Line {line_number}: could not read the percentage "
+                    f"{row.get('percentage')!r} for {row['student']}; skipping."
+                )
+                continue
+
+            rows.append((row["student"].strip(), time_multiplier))
+
+    return rows
+
+
+def write_accommodations_csv(
+    path: Path, accommodations: list[tuple[User, float]]
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["student", "percentage"])
+        for student, time_multiplier in accommodations:
+            writer.writerow([student.id, f"{time_multiplier * 100:g}"])
+
+
+def choose_between_students(identifier: str, candidates: list[User]) -> User | None:
+    """
+    Asks which of the students sharing the name `identifier` is meant, or
+    returns None if the user skips the row.
+    """
+    print(f"\n{len(candidates)} students are named {identifier}:\n")
+    for number, student in enumerate(candidates, start=1):
+        sis_user_id = getattr(student, "sis_user_id", None) or "no LU id"
+        print(f"    {number}. {student.name} (Canvas id {student.id}, {sis_user_id})")
+    print()
+
+    while True:
+        choice = input("Enter the number of the student (blank to skip this row): ")
+        if not choice.strip():
+            return None
+
+        try:
+            number = int(choice)
+            if 1 <= number <= len(candidates):
+                return candidates[number - 1]
+        except ValueError:
+            pass
+
+        print(f"Please enter a number from 1 to {len(candidates)}.")
+
+
+def resolve_accommodations(
+    course: Course, rows: list[tuple[str, float]]
+) -> list[tuple[User, float]]:
+    """
+    Matches each row's student by Canvas id, LU id, or name. A name that
+    more than one student shares is only resolved by asking which one.
+    """
+    students_by_id = {}
+    students_by_name = defaultdict(list)
+    for student in course.get_users(enrollment_type="student"):
+        students_by_id[str(student.id)] = student
+        if getattr(student, "sis_user_id", None):
+            students_by_id[student.sis_user_id] = student
+        students_by_name[normalize_name(student.name)].append(student)
+
+    accommodations = []
+    for identifier, time_multiplier in rows:
+        candidates = students_by_name.get(normalize_name(identifier), [])
+        if identifier in students_by_id:
+            student = students_by_id[identifier]
+        elif len(candidates) > 1:
+            student = choose_between_students(identifier, candidates)
+            if not student:
+                print(f"Skipped {identifier}.")
+                continue
+        elif candidates:
+            student = candidates[0]
+        else:
+            print(f"No student in {course.name} matches {identifier}; skipping.")
+            continue
+
+        accommodations.append((student, time_multiplier))
+
+    return accommodations
+
+
+def prompt_for_accommodations_path(course: Course) -> Path:
+    stored_path = _stored_accommodations_path(course)
+    if stored_path.exists():
+        use_stored = input(f"Reuse the accomodations saved for {course.name} (y/n)? ")
+        if use_stored == "y":
+            return stored_path
+
+    while True:
+        path = Path(input("Enter the path to the accomodations CSV: ").strip())
+        if path.is_file():
+            return path
+
+        print("No such file was found.")
+
+
+def run_bulk_mode(course: Course) -> None:
+    path = prompt_for_accommodations_path(course)
+    rows = read_accommodations_csv(path)
+    accommodations = resolve_accommodations(course, rows)
+
+    print()
+    print("The following accomodations will be applied:")
+    for student, time_multiplier in accommodations:
+        print(f"    {student.name:30} +{time_multiplier * 100:g}%")
+    print()
+
+    confirm = input("Apply these accomodations (y/n)? ")
+    if confirm != "y":
+        return
+
+    cvu.set_time_limits_for_quizzes_in_bulk(course, accommodations)
+    write_accommodations_csv(_stored_accommodations_path(course), accommodations)
 
 
 def main():
     canvas = cvu.create_canvas_object()
     course = cvu.prompt_for_course(canvas)
 
+    print()
+    bulk_mode = input(
+        "Apply accomodations for many students at once from a CSV (y/n)? "
+    )
+    if bulk_mode == "y":
+        print()
+        run_bulk_mode(course)
+        return
+
     while True:
         print()
         student = cvu.prompt_for_student(course)
@@ -20,7 +194,7 @@ def main():
                 percentage = input(
                     "Enter the percentage of time to add (e.g. '50' for 50%): "
                 )
-                time_multiplier = int(percentage) / 100
+                time_multiplier = parse_percentage(percentage)
 
                 break
             except ValueError:
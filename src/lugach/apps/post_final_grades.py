@@ -21,7 +21,8 @@ def get_grade_from_points(points):
     return "F"
 
 
-def post_final_grades(course_sis_id, lh_auth_header, students):
+def post_final_grades(course_sis_id, lh_client, students):
+    grades = []
     for i, student in enumerate(students):
         name = student["firstName"] + " " + student["lastName"]
 
@@ -47,15 +48,18 @@ def post_final_grades(course_sis_id, lh_auth_header, students):
         else:
             grade = get_grade_from_points(points)
 
-        final_grade_posted = lhu.post_final_grade(
-            course_sis_id, lh_auth_header, student, grade
-        )
-        if not final_grade_posted:
-            print(f"Final grade failed to post for {student}... ({i} so far)")
+        grades.append((student, grade))
+
+    results = lhu.post_final_grades_in_bulk(course_sis_id, lh_client, grades)
+    for result in results:
+        student, grade = result.item
+        name = student["firstName"] + " " + student["lastName"]
+        if result.error:
+            print(f"Final grade failed to post for {name}: {result.error}")
             continue
 
         print(
-            f"Posted final grade {grade} for student {name} with {points} points... ({i} so far)"
+            f"Posted final grade {grade} for student {name} with {student['points']} points."
         )
 
 
@@ -65,17 +69,18 @@ def main():
         return
 
     canvas = cvu.create_canvas_object()
-    course = cvu.prompt_for_course(canvas)
+    courses = cvu.prompt_for_courses(canvas)
 
     username, password = lhu.get_liberty_credentials()
-    course_sis_id, lh_auth_header = lhu.get_lh_auth_credentials_for_session(
-        course, username, password
-    )
+    lh_client = lhu.create_lh_client(courses[0], username, password)
 
-    students = lhu.get_lh_students(course_sis_id, lh_auth_header)
+    for course in courses:
+        print()
+        course_sis_id = cvu.get_course_sis_id(course)
+        students = lhu.get_lh_students(course_sis_id, lh_client)
 
-    continue_to_post_grades = input(f"Post grades for {course['course_name']} (y/n)? ")
-    if continue_to_post_grades != "y":
-        return
+        continue_to_post_grades = input(f"Post grades for {course.name} (y/n)? ")
+        if continue_to_post_grades != "y":
+            continue
 
-    post_final_grades(course_sis_id, lh_auth_header, students)
+        post_final_grades(course_sis_id, lh_client, students)
@@ -2,6 +2,7 @@ import lugach.core.cvutils as cvu
 
 from canvasapi.exceptions import BadRequest
 from itertools import chain
+from lugach.core.fanout import fan_out
 
 
 def print_selected_courses(selected_courses):
@@ -36,12 +37,34 @@ def confirm_courses_to_search(selected_courses):
 
 def take_student_query(sources):
     while True:
-        try:
-            query = input("Search for the student by name: ")
-            sources = [cvu.filter_users_by_query(source, query) for source in sources]
-            return sources
-        except BadRequest as e:
-            cvu.process_bad_request(e)
+        query = input("Search for the student by name: ")
+        results = fan_out(
+            sources,
+            lambda source, query=query: cvu.filter_users_by_query(source, query),
+        )
+
+        bad_request = next(
+            (
+                result.error
+                for result in results
+                if isinstance(result.error, BadRequest)
+            ),
+            None,
+        )
+        if bad_request:
+            cvu.process_bad_request(bad_request)
+            continue
+
+        new_sources = []
+        for result in results:
+            if result.error:
+                print(f"Skipping a course that could not be searched ({result.error}).")
+                new_sources.append([])
+                continue
+
+            new_sources.append(result.value)
+
+        return new_sources
 
 
 def main():
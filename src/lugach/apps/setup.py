@@ -50,7 +50,9 @@ def set_up_canvas_api_key():
 def set_up_th_auth_key():
     while True:
         try:
-            thu.get_auth_header_for_session()
+            # Exchange the key now rather than trusting a saved JWT, so that
+            # a rejected key is caught here.
+            thu.create_th_client(force_refresh=True)
             return
         except (NameError, ConnectionRefusedError) as e:
             print(e)
@@ -0,0 +1,153 @@
+"""
+Moves a block of due dates at once, e.g. after a cancelled class day.
+
+Every assignment and quiz due within a date window has its due, lock, and
+unlock dates shifted by the same number of days, along with all of its
+overrides. Days are counted on the course's wall clock, so a quiz due at
+23:59 is still due at 23:59 after the window crosses a daylight saving
+change. The changes are shown as a dry run before anything is sent.
+"""
+
+from datetime import datetime, timedelta, tzinfo
+
+from canvasapi.assignment import Assignment, AssignmentOverride
+from canvasapi.course import Course
+from dateutil.parser import ParserError, parse
+
+import lugach.core.cvutils as cvu
+from lugach.core.fanout import fan_out
+
+DATE_FIELDS = ["due_at", "lock_at", "unlock_at"]
+
+
+def get_date(prompt: str) -> datetime:
+    while True:
+        try:
+            return parse(input(prompt)).astimezone()
+        except ParserError:
+            print("Please enter a date in the proper format.")
+
+
+def get_shift() -> int:
+    while True:
+        try:
+            return int(input("How many days should the dates move (e.g. 2 or -1)? "))
+        except ValueError:
+            print("Please enter a whole number of days.")
+
+
+def shift_dates(
+    attributes: dict, days: int, time_zone: tzinfo
+) -> dict[str, tuple[str, str]]:
+    """
+    Returns the shifted value of each date field set in `attributes`, as
+    `{field: (old_value, new_value)}`.
+    """
+    return {
+        field: (attributes[field], cvu.shift_date(attributes[field], days, time_zone))
+        for field in DATE_FIELDS
+        if attributes.get(field)
+    }
+
+
+def plan_shift(
+    course: Course, window_start: datetime, window_end: datetime, days: int
+) -> list[dict]:
+    """
+    Works out every edit needed to shift the assignments and quizzes due in
+    the window, without sending any of them.
+    """
+    time_zone = cvu.get_course_time_zone(course)
+    quizzes_by_id = {quiz.id: quiz for quiz in course.get_quizzes()}
+    assignments = list(course.get_assignments(include=["overrides"]))
+    due_dates = cvu.get_due_dates_by_assignment(course, assignments, quizzes_by_id)
+
+    changes = []
+    for assignment in assignments:
+        due_date = due_dates[assignment.id]
+        if not due_date or not window_start <= due_date < window_end:
+            continue
+
+        quiz = quizzes_by_id.get(getattr(assignment, "quiz_id", None))
+        target = quiz if assignment.is_quiz_assignment and quiz else assignment
+        changes.append(
+            {
+                "name": assignment.name,
+                "target": target,
+                "dates": shift_dates(vars(target), days, time_zone),
+            }
+        )
+
+        # canvasapi has already made these into `AssignmentOverride`s.
+        for override in getattr(assignment, "overrides", []):
+            if getattr(override, "course_id", None) is None:
+                # `AssignmentOverride.edit` needs it for the URL.
+                override.course_id = course.id
+            changes.append(
+                {
+                    "name": f"{assignment.name} ({override.title})",
+                    "target": override,
+                    "dates": shift_dates(vars(override), days, time_zone),
+                }
+            )
+
+    return [change for change in changes if change["dates"]]
+
+
+def apply_change(change: dict) -> None:
+    target = change["target"]
+    new_dates = {field: new for field, (_, new) in change["dates"].items()}
+
+    if isinstance(target, Assignment):
+        target.edit(assignment=new_dates)
+    elif isinstance(target, AssignmentOverride):
+        # Canvas drops any overridden value that the update leaves out.
+        retained = {
+            key: getattr(target, key)
+            for key in ["title", "student_ids", "due_at", "lock_at", "unlock_at"]
+            if getattr(target, key, None) is not None
+        }
+        target.edit(assignment_override={**retained, **new_dates})
+    else:
+        target.edit(quiz=new_dates)
+
+
+def print_plan(changes: list[dict]) -> None:
+    for change in changes:
+        print(f"    {change['name']}")
+        for field, (old, new) in change["dates"].items():
+            print(f"        {field:10} {old} -> {new}")
+
+
+def main():
+    canvas = cvu.create_canvas_object()
+    course = cvu.prompt_for_course(canvas)
+
+    print()
+    window_start = get_date("Shift items due on or after (mm-dd-YYYY): ")
+    window_end = get_date("...and on or before (mm-dd-YYYY): ") + timedelta(days=1)
+    days = get_shift()
+
+    changes = plan_shift(course, window_start, window_end, days)
+    if not changes:
+        print("Nothing is due in that window.")
+        input("Press ENTER to quit.")
+        return
+
+    print()
+    print("Dry run: the following dates would change.")
+    print_plan(changes)
+    print()
+
+    confirm = input(f"Apply these {len(changes)} changes (y/n)? ")
+    if confirm != "y":
+        return
+
+    # A PUT still running at a timeout may yet land, so wait for every one.
+    results = fan_out(changes, apply_change, timeout=None)
+    failures = [result for result in results if result.error]
+    for result in failures:
+        print(f"Failed to update {result.item['name']}: {result.error}")
+
+    print(f"Updated {len(results) - len(failures)} of {len(results)} items.")
+    input("Press ENTER to continue.")
@@ -1,30 +1,276 @@
+"""
+Opens attendance in one or more Top Hat courses and shows the counts as
+students check in.
+
+The counts refresh on their own: every second or so while check-ins are
+arriving, backing off to every few seconds once they stop. Each course's
+attendance can be closed automatically once a target share of the class has
+checked in or a time limit has passed; otherwise they are closed together
+at the end.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import lugach.core.constants as cs
 import lugach.core.thutils as thu
+from lugach.core.fanout import fan_out
 
 
-def main():
-    auth_header = thu.get_auth_header_for_session()
+def _read_keys(keys: queue.Queue) -> None:
+    """
+    Forwards each line the user enters to `keys` until they enter `q`, so
+    the monitor can keep polling while waiting for input.
+    """
+    while True:
+        try:
+            line = input().strip().lower()
+        except EOFError:
+            line = "q"
+
+        keys.put(line)
+        if line == "q":
+            return
+
+
+def next_poll_interval(interval: float, new_check_ins: int) -> float:
+    if new_check_ins:
+        return cs.TH_MONITOR_MIN_POLL_SECS
+
+    return min(interval * cs.TH_MONITOR_BACKOFF_FACTOR, cs.TH_MONITOR_MAX_POLL_SECS)
+
+
+def prompt_for_courses(client: thu.TopHatClient) -> list[thu.Course]:
+    courses = list(thu.get_th_courses(client))
+    print("Which courses would you like to take attendance in?")
+    for i, course in enumerate(courses, start=1):
+        print(f"{i:4}. {course['course_name']}")
+    print()
+
+    while True:
+        try:
+            choices = input("Enter the indices of the courses (e.g. 1, 4, 5): ")
+            indices = {int(choice) for choice in choices.replace(",", " ").split()}
+            if not indices or not all(1 <= i <= len(courses) for i in indices):
+                raise ValueError
 
-    course = thu.prompt_user_for_th_course(auth_header)
-    course_id = course["course_id"]
+            return [courses[i - 1] for i in sorted(indices)]
+        except ValueError:
+            print("Please enter indices from the list above.")
 
-    attendance_item, _ = thu.create_attendance(auth_header, course_id)
-    attendance_item_id = attendance_item["id"]
 
+def prompt_for_auto_close() -> tuple[float | None, float | None]:
+    """
+    Returns the share of students (from 0 to 1) and the number of seconds
+    after which attendance should close on its own, or None for either.
+    """
     while True:
-        attended_students, total_students = thu.monitor_attendance(
-            auth_header, course_id, attendance_item_id
+        try:
+            target = input("Close once this percent have checked in (blank for none): ")
+            target = int(target) / 100 if target.strip() else None
+
+            time_limit = input("Close after this many minutes (blank for none): ")
+            time_limit = float(time_limit) * 60 if time_limit.strip() else None
+
+            return target, time_limit
+        except ValueError:
+            print("Please enter a number or leave it blank.")
+
+
+def open_attendance(client: thu.TopHatClient, courses: list[thu.Course]) -> list[dict]:
+    """
+    Opens (or finds the already open) attendance item in every course at
+    once, returning the state the monitor keeps for each one.
+    """
+    # An open still running at a timeout may yet succeed, so wait for each.
+    results = fan_out(
+        courses,
+        lambda course: thu.create_attendance(client, course["course_id"]),
+        timeout=None,
+    )
+
+    sessions = []
+    for result in results:
+        course = result.item
+        if result.error:
+            print(
+                f"Could not open attendance in {course['course_name']}: {result.error}"
+            )
+            continue
+
+        attendance_item, _ = result.value
+        sessions.append(
+            {
+                "course": course,
+                "item_id": attendance_item["id"],
+                "code": attendance_item["code"],
+                "attended": 0,
+                "total": 0,
+                "status": "open",
+            }
         )
 
-        print()
-        print(f"Attendance: {attended_students}/{total_students}")
-        continue_monitoring = input("Press ENTER to refresh or q to quit monitoring. ")
+    return sessions
+
+
+def poll_sessions(client: thu.TopHatClient, sessions: list[dict]) -> int:
+    """
+    Refreshes the count of every open session at once and returns how many
+    students checked in since the last poll.
+    """
+    open_sessions = [session for session in sessions if session["status"] == "open"]
+    results = fan_out(
+        open_sessions,
+        lambda session: thu.monitor_attendance(
+            client, session["course"]["course_id"], session["item_id"]
+        ),
+    )
+
+    new_check_ins = 0
+    for result in results:
+        session = result.item
+        if result.error:
+            session["note"] = "retrying"
+            continue
+
+        attended, total = result.value
+        new_check_ins += attended - session["attended"]
+        session.update(attended=attended, total=total, note="")
+
+    return new_check_ins
+
+
+def close_sessions(client: thu.TopHatClient, sessions: list[dict]) -> None:
+    results = thu.close_attendance_in_bulk(
+        client,
+        [(session["course"]["course_id"], session["item_id"]) for session in sessions],
+    )
+    for result, session in zip(results, sessions):
+        if result.error:
+            session["note"] = f"failed to close ({result.error})"
+        else:
+            session["status"] = "closed"
 
-        if continue_monitoring == "q":
-            break
+
+def format_session(session: dict) -> str:
+    share = session["attended"] / max(session["total"], 1)
+    return (
+        f"{session['course']['course_name']:30.30} | code {session['code']} | "
+        f"{session['attended']:3}/{session['total']:<3} ({share:4.0%}) | "
+        f"{session['status']} {session.get('note', '')}"
+    )
+
+
+def redraw(lines: list[str], lines_to_clear: int) -> None:
+    if lines_to_clear:
+        print(f"\x1b[{lines_to_clear}F", end="")
+    for line in lines:
+        print(f"\x1b[2K{line}")
+
+
+def monitor_until_done(
+    client: thu.TopHatClient,
+    sessions: list[dict],
+    target: float | None,
+    time_limit: float | None,
+    keys: queue.Queue,
+) -> None:
+    """
+    Redraws every session's code and count in place, closing each one once
+    it reaches the target or the time limit passes, until every session is
+    closed or the user enters `q`. Entering anything else refreshes the
+    counts immediately.
+    """
+    start = time.monotonic()
+    interval = cs.TH_MONITOR_MIN_POLL_SECS
+    lines_to_clear = 0
+
+    while True:
+        new_check_ins = poll_sessions(client, sessions)
+        interval = next_poll_interval(interval, new_check_ins)
+
+        elapsed = time.monotonic() - start
+        out_of_time = time_limit is not None and elapsed >= time_limit
+        finished_sessions = [
+            session
+            for session in sessions
+            if session["status"] == "open"
+            and (
+                out_of_time
+                or (
+                    target is not None
+                    and session["total"]
+                    and session["attended"] / session["total"] >= target
+                )
+            )
+        ]
+        if finished_sessions:
+            close_sessions(client, finished_sessions)
+
+        minutes, seconds = divmod(int(elapsed), 60)
+        lines = [format_session(session) for session in sessions]
+        lines.append(f"{minutes}m{seconds:02}s elapsed | ENTER to refresh, q to stop")
+        redraw(lines, lines_to_clear)
+        lines_to_clear = len(lines)
+
+        if all(session["status"] == "closed" for session in sessions):
+            return
+
+        wait = interval
+        if time_limit is not None:
+            wait = max(0, min(wait, time_limit - elapsed))
+
+        try:
+            if keys.get(timeout=wait) == "q":
+                return
+            # The ENTER the user pressed moved the cursor down a line.
+            lines_to_clear += 1
+        except queue.Empty:
+            pass
+
+
+def main():
+    if os.name == "nt":
+        os.system("")  # Turns on ANSI escape codes in the Windows console
+
+    client = thu.create_th_client()
+
+    several_courses = input("Take attendance in several courses at once (y/n)? ")
+    print()
+    if several_courses == "y":
+        courses = prompt_for_courses(client)
+    else:
+        courses = [thu.prompt_user_for_th_course(client)]
+
+    sessions = open_attendance(client, courses)
+    if not sessions:
+        return
+
+    print()
+    target, time_limit = prompt_for_auto_close()
+
+    keys = queue.Queue()
+    threading.Thread(target=_read_keys, args=(keys,), daemon=True).start()
+
+    print()
+    monitor_until_done(client, sessions, target, time_limit, keys)
+
+    open_sessions = [session for session in sessions if session["status"] == "open"]
+    if not open_sessions:
+        print("Attendance is closed. Press ENTER to quit.")
+        keys.get()
+        return
 
     print()
-    prompt_to_close = input("Would you like to close attendance? (y/n) ")
+    s = "" if len(open_sessions) == 1 else "s"
+    prompt_to_close = input(
+        f"Would you like to close attendance in the {len(open_sessions)} open course{s}? (y/n) "
+    )
     if prompt_to_close != "y":
         return
 
-    thu.close_attendance(auth_header, course_id, attendance_item_id)
+    close_sessions(client, open_sessions)
+    for session in open_sessions:
+        print(format_session(session))
@@ -1,14 +1,43 @@
 import lugach.core.constants as cs
 import lugach.core.cvutils as cvu
 import lugach.core.lhutils as lhu
-import requests
+from canvasapi.course import Course
 from canvasapi.user import User
 
+from lugach.core.fanout import fan_out
 
-def find_cv_student_from_lh_student(course, lh_student: dict) -> User | None:
+
+LUID_ATTRIBUTES = ("sis_user_id", "login_id", "integration_id")
+
+
+def index_students_by_luid(students: list[User]) -> dict[str, User]:
+    """
+    Maps every id on a student's Canvas profile that could be their LU id
+    (`LUID_ATTRIBUTES`) to the student. Warns when no student has a
+    `sis_user_id`, which Canvas leaves out without the "read SIS data"
+    permission.
+    """
+    if students and not any(getattr(s, "sis_user_id", None) for s in students):
+        print(
+            "WARNING: Canvas returned no SIS ids for this course, probably "
+            "because your account cannot read SIS data. Students will be "
+            "looked up one at a time, which is much slower."
+        )
+
+    students_by_luid = {}
+    for student in students:
+        for attribute in LUID_ATTRIBUTES:
+            luid = getattr(student, attribute, None)
+            if luid:
+                students_by_luid.setdefault(str(luid), student)
+
+    return students_by_luid
+
+
+def find_cv_student_from_lh_student(course: Course, lh_student: dict) -> User | None:
     luid = lh_student["luId"]
 
-    cv_students = list(course.get_users(search_term=luid))
+    cv_students = list(course.get_users(search_term=luid, enrollment_type="student"))
     cv_students_len = len(cv_students)
 
     if cv_students_len == 0:
@@ -25,61 +54,69 @@ def find_cv_student_from_lh_student(course, lh_student: dict) -> User | None:
         return cv_students[0]
 
 
-def main():
-    username, password = lhu.get_liberty_credentials()
-    canvas = cvu.create_canvas_object()
-    course = cvu.prompt_for_course(canvas)
-
-    course_sis_id, lh_auth_header = lhu.get_lh_auth_credentials_for_session(
-        course, username, password
+def update_attendance_verification(course, course_sis_id, lh_client, all_students):
+    students = list(cvu.iter_prefetched(course.get_users(enrollment_type="student")))
+    submissions = cvu.iter_prefetched(
+        course.get_multiple_submissions(student_ids=["all"], workflow_state="graded")
     )
-    all_students = lhu.get_lh_students(course_sis_id, lh_auth_header)
+    students_by_luid = index_students_by_luid(students)
+    graded_user_ids = {submission.user_id for submission in submissions}
 
-    continue_to_update_attendance_verification = input(
-        f"Update attendance verification for {course['course_name']} (y/n)? "
-    )
-    if continue_to_update_attendance_verification != "y":
-        return
-
-    for num_students, lh_student in enumerate(all_students, start=1):
+    to_update = []
+    for lh_student in all_students:
         name = f"{lh_student['firstName']} {lh_student['lastName']}"
 
         if lh_student["status"] == "REMOVED" or lh_student["attendance"] == "ATTENDED":
-            print(f"Skipped {name}... ({num_students} processed so far)")
+            print(f"Skipped {name}...")
             continue
 
-        cv_student = find_cv_student_from_lh_student(course, lh_student)
+        cv_student = students_by_luid.get(str(lh_student["luId"]))
         if not cv_student:
-            print(
-                f"No Canvas student found that matches {name}... ({num_students} processed so far)"
-            )
-            continue
+            cv_student = find_cv_student_from_lh_student(course, lh_student)
 
-        submission = list(
-            course.get_multiple_submissions(
-                student_ids=[cv_student.id], workflow_state="graded"
-            )
+        if not cv_student:
+            print(f"No Canvas student found that matches {name}...")
+        elif cv_student.id not in graded_user_ids:
+            print(f"No submissions for {name}...")
+        else:
+            to_update.append(lh_student)
+
+    results = fan_out(
+        to_update,
+        lambda lh_student: lhu.post_attendance_verification(
+            course_sis_id, lh_client, lh_student
+        ),
+        max_workers=cs.LH_MAX_WORKERS,
+        timeout=None,
+    )
+    for result in results:
+        name = f"{result.item['firstName']} {result.item['lastName']}"
+        if result.error:
+            print(f"Failed to update attendance for {name}: {result.error}")
+        else:
+            print(f"Attendance updated for {name}...")
+
+    updated = sum(1 for result in results if not result.error)
+    print(f"Updated {updated} of {len(all_students)} enrollments.")
+
+
+def main():
+    username, password = lhu.get_liberty_credentials()
+    canvas = cvu.create_canvas_object()
+    courses = cvu.prompt_for_courses(canvas)
+
+    lh_client = lhu.create_lh_client(courses[0], username, password)
+
+    for course in courses:
+        print()
+        course_sis_id = cvu.get_course_sis_id(course)
+        all_students = lhu.get_lh_students(course_sis_id, lh_client)
+
+        continue_to_update_attendance_verification = input(
+            f"Update attendance verification for {course.name} (y/n)? "
         )
-        if not submission:
-            print(f"No submissions for {name}... ({num_students} processed so far)")
+        if continue_to_update_attendance_verification != "y":
             continue
 
-        attendance_url = f"https://lighthouse.okd.liberty.edu/rest/enrollments/{lh_student['id']}/attendance?courseSisId={course_sis_id}&sis=banner&lms=canvas_lu"
-        payload = {"attendance": "ATTENDED"}
-        for i in range(1, cs.RELOAD_ATTEMPTS + 1):
-            response = requests.post(
-                url=attendance_url, json=payload, headers=lh_auth_header
-            )
-            if response.status_code != 200:
-                print(
-                    f"{response.request.method} request returned with code {response.status_code}; retrying... ({i} of {cs.RELOAD_ATTEMPTS} attempts so far)"
-                )
-                continue
-
-            print(f"Attendance updated for {name}... ({num_students} processed so far)")
-            break
-        else:
-            print(
-                f"Failed to update attendance for {name}... ({num_students} processed so far)"
-            )
+        update_attendance_verification(course, course_sis_id, lh_client, all_students)
 
@@ -1,11 +1,11 @@
 from canvasapi.exceptions import ResourceDoesNotExist
 import click
-import json
 import lugach.core.thutils as thu
 import lugach.core.cvutils as cvu
 
 from lugach.cli import interactive, utils
 from lugach.apps import app_names_and_descriptions, lint_app_name, run_app_from_app_name
+from lugach.core.fanout import fan_out
 
 
 @click.group()
@@ -66,7 +66,8 @@ def cv() -> None:
     "--role",
     help="Filter by a certain role. Options: TA, Designer, Student. Default: Designer",
 )
-def cv_courses(role) -> None:
+@utils.format_option
+def cv_courses(role, output_format) -> None:
     """Get a list of courses that the user can access."""
     if not role:
         role = "designer"
@@ -74,14 +75,15 @@ def cv_courses(role) -> None:
     canvas = cvu.create_canvas_object()
     courses = cvu.get_courses(canvas, enrolled_as=role)
     parsed_courses = utils.parse_canvas_courses_for_cli(courses)
-    click.echo(json.dumps(parsed_courses, indent=4))
+    utils.echo_records(parsed_courses, output_format)
 
 
 @cv.command("students")
 @click.argument("course_id", required=True)
 @click.option("-c", is_flag=True, help="Return the number of students.")
 @click.option("--name", help="Filter names by a given string.")
-def cv_students(course_id, c, name) -> None:
+@utils.format_option
+def cv_students(course_id, c, name, output_format) -> None:
     """
     Get a list of students in a given course.
 
@@ -107,19 +109,20 @@ def cv_students(course_id, c, name) -> None:
     if c:
         # Count manually so we don't have to deal with the rate limitations of PaginatedList
         count = 0
-        for _ in students:
+        for _ in cvu.iter_prefetched(students):
             count += 1
 
         click.echo(count)
         return
 
     parsed_students = utils.parse_canvas_users_for_cli(students, name)
-    click.echo(json.dumps(parsed_students, indent=4))
+    utils.echo_records(parsed_students, output_format)
 
 
 @cv.command()
 @click.argument("course_id", required=True)
-def assignments(course_id):
+@utils.format_option
+def assignments(course_id, output_format):
     """
     Get a list of assignments in a given course.
 
@@ -143,7 +146,7 @@ def assignments(course_id):
 
     assignments = course.get_assignments()
     parsed_assignments = utils.parse_canvas_assignments_for_cli(assignments)
-    click.echo(json.dumps(parsed_assignments, indent=4))
+    utils.echo_records(parsed_assignments, output_format)
 
 
 @cli.group()
@@ -152,18 +155,20 @@ def th() -> None:
 
 
 @th.command("courses")
-def th_courses() -> None:
+@utils.format_option
+def th_courses(output_format) -> None:
     """Get a list of courses that the user oversees."""
-    auth_header = thu.get_auth_header_for_session()
-    courses = thu.get_th_courses(auth_header)
+    client = thu.create_th_client()
+    courses = thu.get_th_courses(client)
     parsed_courses = utils.parse_top_hat_courses_for_cli(courses)
 
-    click.echo(json.dumps(parsed_courses, indent=4))
+    utils.echo_records(parsed_courses, output_format)
 
 
 @th.command()
 @click.argument("course_id", required=True)
-def students(course_id):
+@utils.format_option
+def students(course_id, output_format):
     """
     Get a list of students in a given course.
 
@@ -176,8 +181,57 @@ def students(course_id):
         click.secho("Error: Expected a valid COURSE_ID.", fg="red", err=True)
         return
 
-    auth_header = thu.get_auth_header_for_session()
-    students = thu.get_th_students(auth_header, course_id=course_id)
+    client = thu.create_th_client()
+    students = thu.get_th_students(client, course_id=course_id)
     parsed_students = utils.parse_top_hat_students_for_cli(students)
 
-    click.echo(json.dumps(parsed_students, indent=4))
+    utils.echo_records(parsed_students, output_format)
+
+
+@th.command()
+@click.argument("course_id", required=False)
+@click.option(
+    "--all-courses", is_flag=True, help="Check every course instead of COURSE_ID."
+)
+@click.option(
+    "--tolerance",
+    type=int,
+    default=4,
+    show_default=True,
+    help="The max number of absences for the course.",
+)
+@utils.format_option
+def absences(course_id, all_courses, tolerance, output_format):
+    """
+    Get the students who are at or one away from the absence limit.
+
+    COURSE_ID: The id of the Top Hat course. Required unless --all-courses is given.
+    """
+
+    client = thu.create_th_client()
+    if all_courses:
+        courses = list(thu.get_th_courses(client))
+    else:
+        try:
+            courses = [{"course_id": int(course_id), "course_name": None}]
+        except (TypeError, ValueError):
+            click.secho(
+                "Error: Expected a valid COURSE_ID or --all-courses.",
+                fg="red",
+                err=True,
+            )
+            return
+
+    results = fan_out(
+        courses, lambda course: thu.get_th_absence_counts(client, course), timeout=None
+    )
+    for result in results:
+        if result.error:
+            click.secho(
+                f"Error: Failed to check {result.item['course_id']} ({result.error}).",
+                fg="red",
+                err=True,
+            )
+
+    parsed_absences = utils.parse_top_hat_absences_for_cli(results, tolerance)
+    utils.echo_records(parsed_absences, output_format)
@@ -1,68 +1,117 @@
+import csv
+import json
+from typing import Iterable, Iterator
+
+import click
 from canvasapi.assignment import Assignment
 from canvasapi.course import Course
 from canvasapi.user import User
 from canvasapi.page import PaginatedList
 
+import lugach.core.cvutils as cvu
+from lugach.core.fanout import FanOutResult
+
+OUTPUT_FORMATS = ["json", "ndjson", "csv"]
+
+format_option = click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="json",
+    show_default=True,
+    help="json prints one array once everything is fetched; ndjson and csv print each record as soon as its page arrives.",
+)
+
+
+def _iter_records(records: PaginatedList | Iterable) -> Iterator:
+    if type(records) is PaginatedList:
+        return cvu.iter_prefetched(records, parallel=False)
+
+    return iter(records)
+
+
+def echo_records(records: Iterable[dict], output_format: str) -> None:
+    """
+    Prints records in the given format. The streaming formats (ndjson and
+    csv) write each record as it is produced and hold no more than one
+    record in memory.
+    """
+    if output_format == "json":
+        click.echo(json.dumps(list(records), indent=4))
+        return
+
+    stdout = click.get_text_stream("stdout")
+    if output_format == "ndjson":
+        for record in records:
+            stdout.write(json.dumps(record) + "\n")
+            stdout.flush()
+        return
+
+    writer = None
+    for record in records:
+        if writer is None:
+            writer = csv.DictWriter(stdout, fieldnames=list(record))
+            writer.writeheader()
+
+        writer.writerow(record)
+        stdout.flush()
 
-def parse_canvas_courses_for_cli(courses: PaginatedList | list[Course]) -> list[dict]:
-    return [
+
+def parse_canvas_courses_for_cli(
+    courses: PaginatedList | list[Course],
+) -> Iterator[dict]:
+    return (
         {
             "name": course.name,
             "id": course.id,
             "start_at": course.start_at,
             "end_at": course.end_at,
         }
-        for course in courses
-    ]
+        for course in _iter_records(courses)
+    )
 
 
 def parse_canvas_users_for_cli(
     users: PaginatedList | list[User], filter: str | None
-) -> list[dict]:
-    if type(users) is PaginatedList:
-        users = list(users)
-
-    return [
+) -> Iterator[dict]:
+    return (
         {
             "name": user.name,
             "id": user.id,
             "sis_user_id": user.sis_user_id,
             "email": user.email,
         }
-        for user in users
+        for user in _iter_records(users)
         if not filter or filter in user.name
-    ]
+    )
 
 
 def parse_canvas_assignments_for_cli(
     assignments: PaginatedList | list[Assignment],
-) -> list[dict]:
-    if type(assignments) is PaginatedList:
-        assignments = list(assignments)
-
-    return [
+) -> Iterator[dict]:
+    return (
         {
             "name": assignment.name,
             "id": assignment.id,
             "quiz_id": assignment.quiz_id if hasattr(assignment, "quiz_id") else "",
             "due_at": assignment.due_at,
         }
-        for assignment in assignments
-    ]
+        for assignment in _iter_records(assignments)
+    )
 
 
-def parse_top_hat_courses_for_cli(courses: list[dict]) -> list[dict]:
-    return [
+def parse_top_hat_courses_for_cli(courses: Iterable[dict]) -> Iterator[dict]:
+    return (
         {
             "name": course["course_name"],
             "id": course["course_id"],
         }
         for course in courses
-    ]
+    )
 
 
-def parse_top_hat_students_for_cli(students: list[dict]) -> list[dict]:
-    return [
+def parse_top_hat_students_for_cli(students: Iterable[dict]) -> Iterator[dict]:
+    return (
         {
             "name": student["name"],
             "id": student["id"],
@@ -70,4 +119,23 @@ def parse_top_hat_students_for_cli(students: list[dict]) -> list[dict]:
             "sis_user_id": student["student_id"],
         }
         for student in students
-    ]
+    )
+
+
+def parse_top_hat_absences_for_cli(
+    results: list[FanOutResult], tolerance: int
+) -> Iterator[dict]:
+    return (
+        {
+            "course_id": result.item["course_id"],
+            "course_name": result.item["course_name"],
+            "name": student["name"],
+            "id": student["id"],
+            "email": student["email"],
+            "absences": absences,
+        }
+        for result in results
+        if not result.error
+        for student, absences in result.value
+        if absences >= tolerance - 1
+    )
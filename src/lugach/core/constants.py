@@ -19,10 +19,52 @@ def _get_grade_ranges():
 GLOBAL_TIMEOUT_SECS = 5
 RELOAD_ATTEMPTS = 10
 CHUNK_SIZE = 20
+CANVAS_PER_PAGE = 100
+MAX_WORKERS = 8
+MAX_URL_LENGTH = 8000
+TARGET_BATCH_SECS = 2.0
+FAN_OUT_TIMEOUT_SECS = 30
+OVERRIDE_BATCH_SIZE = 50
+ASYNC_BULK_MESSAGE_THRESHOLD = 20
+PROGRESS_POLL_SECS = 1
+BATCH_POLL_TIMEOUT_SECS = 10 * 60
+
+RETRY_BACKOFF_SECS = 0.5
+RETRY_MAX_BACKOFF_SECS = 30
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECS = 30
+
+TH_TIMEOUT_SECS = (3.05, 15)
+TH_GRADEBOOK_TIMEOUT_SECS = (3.05, 60)
+TH_JWT_REFRESH_MARGIN_SECS = 5 * 60
+TH_PAGE_SIZE = 2000
+TH_RETRY_ATTEMPTS = 3
+TH_MONITOR_MIN_POLL_SECS = 1
+TH_MONITOR_MAX_POLL_SECS = 15
+TH_MONITOR_BACKOFF_FACTOR = 1.5
+
+LH_HEADLESS = True
+LH_EXTERNAL_TOOL_ID = 183
+LH_TIMEOUT_SECS = (3.05, 30)
+LH_TOKEN_TTL_SECS = 60 * 60
+LH_TOKEN_REFRESH_MARGIN_SECS = 5 * 60
+LH_RETRY_ATTEMPTS = 5
+LH_MAX_WORKERS = 4
+
+CANVAS_TIMEOUT_SECS = (3.05, 60)
+CANVAS_RETRY_ATTEMPTS = 5
+CANVAS_RATE_LIMIT_CAPACITY = 700
+CANVAS_RATE_LIMIT_REFILL_PER_SEC = 10
+CANVAS_RATE_LIMIT_LOW_WATER = 100
+CANVAS_INITIAL_REQUEST_COST = 50
+
+USE_CANVAS_STORE = False
+CANVAS_SUBMISSIONS_RESYNC_SECS = 6 * 60 * 60
+CANVAS_SESSION_TTL_SECS = 12 * 60 * 60
 
 QUIZ_CONCERN_TOLERANCE = 2
 QUIZ_CONCERN_SUBJECT = "Quiz concern - {course_name}"
-QUIZ_CONCERN_BODY = """Hello, I've noticed that you've missed multiple quizzes this semester. Make sure to keep up with the class announcements and modules in Canvas. There are two extra credit opportunities that can help you make up the points missed due at the end of the semester.
+QUIZ_CONCERN_BODY = """Hello {student_name}, I've noticed that you've missed {missed_quizzes} quizzes this semester. Make sure to keep up with the class announcements and modules in Canvas. There are two extra credit opportunities that can help you make up the points missed due at the end of the semester.
 
 "Let me know if you have any questions!
 {instructor_name}"""
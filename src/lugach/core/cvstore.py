@@ -0,0 +1,415 @@
+"""
+A local SQLite snapshot of the Canvas data that the apps read most often:
+courses, enrollments, assignments, and submissions.
+
+Each `get_*` function first brings the snapshot up to date and then reads
+from disk. Lists that Canvas cannot filter by date (courses, rosters, and
+assignments) are revalidated page by page with the ETags recorded during the
+last sync, so an unchanged list costs one bodiless 304 per page. Submissions
+are synced incrementally with `submitted_since`/`graded_since` deltas, with a
+full resync whenever new assignments or students appear (their placeholder
+submissions carry neither timestamp) and every
+`cs.CANVAS_SUBMISSIONS_RESYNC_SECS`, which picks up excusals and
+late-policy changes that the deltas miss.
+"""
+
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+from canvasapi import Canvas
+from canvasapi.assignment import Assignment
+from canvasapi.course import Course
+from canvasapi.requester import Requester
+from canvasapi.submission import Submission
+from canvasapi.user import User
+from dateutil.parser import parse
+
+import lugach.core.constants as cs
+from lugach.core.secrets import ROOT_DIR
+
+STORE_PATH = ROOT_DIR / "canvas.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (
+    id INTEGER NOT NULL,
+    enrolled_as TEXT NOT NULL,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (id, enrolled_as)
+);
+CREATE TABLE IF NOT EXISTS enrollments (
+    course_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    enrollment_type TEXT NOT NULL,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (course_id, user_id, enrollment_type)
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    course_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (course_id, id)
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    course_id INTEGER NOT NULL,
+    assignment_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (course_id, assignment_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource TEXT PRIMARY KEY,
+    synced_at TEXT NOT NULL,
+    pages TEXT NOT NULL
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(STORE_PATH)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _requester_for(source: Canvas | Course) -> Requester:
+    if isinstance(source, Canvas):
+        return source._Canvas__requester
+
+    return source._requester
+
+
+def _get_sync_state(conn: sqlite3.Connection, resource: str) -> tuple[str, list]:
+    row = conn.execute(
+        "SELECT synced_at, pages FROM sync_state WHERE resource = ?", (resource,)
+    ).fetchone()
+    if not row:
+        return "", []
+
+    synced_at, pages = row
+    return synced_at, json.loads(pages)
+
+
+def _set_sync_state(
+    conn: sqlite3.Connection, resource: str, synced_at: str, pages: list
+) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_state (resource, synced_at, pages) VALUES (?, ?, ?)",
+        (resource, synced_at, json.dumps(pages)),
+    )
+
+
+def _fetch_all_pages(
+    requester: Requester, endpoint: str, params: list[tuple]
+) -> tuple[list[dict], list[list[str]]]:
+    """
+    Downloads every page of a Canvas list endpoint.
+
+    Returns the records along with the `[url, etag]` pair of each page so
+    that the next sync can revalidate them.
+    """
+    records = []
+    pages = []
+
+    response = requester.request("GET", endpoint, _kwargs=list(params))
+    while True:
+        records.extend(response.json())
+        pages.append([response.url, response.headers.get("ETag", "")])
+
+        next_link = response.links.get("next")
+        if not next_link:
+            break
+
+        response = requester.request("GET", _url=next_link["url"])
+
+    return records, pages
+
+
+def _pages_unchanged(requester: Requester, pages: list[list[str]]) -> bool:
+    if not pages:
+        return False
+
+    for url, etag in pages:
+        if not etag:
+            return False
+
+        response = requester.request("GET", _url=url, headers={"If-None-Match": etag})
+        if response.status_code != 304:
+            return False
+
+    return True
+
+
+def _sync_list(
+    requester: Requester, resource: str, endpoint: str, params: list[tuple]
+) -> list[dict] | None:
+    """
+    Revalidates a snapshotted list endpoint, returning the fresh records if
+    anything changed or None if the snapshot is still current.
+    """
+    with closing(_connect()) as conn:
+        _, pages = _get_sync_state(conn, resource)
+
+    if _pages_unchanged(requester, pages):
+        return None
+
+    synced_at = _now()
+    records, pages = _fetch_all_pages(requester, endpoint, params)
+
+    with closing(_connect()) as conn, conn:
+        _set_sync_state(conn, resource, synced_at, pages)
+
+    return records
+
+
+def sync_courses(canvas: Canvas, enrolled_as="designer") -> None:
+    records = _sync_list(
+        _requester_for(canvas),
+        resource=f"courses:{enrolled_as}",
+        endpoint="courses",
+        params=[("enrollment_type", enrolled_as), ("per_page", cs.CANVAS_PER_PAGE)],
+    )
+    if records is None:
+        return
+
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM courses WHERE enrolled_as = ?", (enrolled_as,))
+        conn.executemany(
+            "INSERT INTO courses (id, enrolled_as, attributes) VALUES (?, ?, ?)",
+            [(record["id"], enrolled_as, json.dumps(record)) for record in records],
+        )
+
+
+def sync_users(course: Course, enrollment_type="student") -> None:
+    records = _sync_list(
+        _requester_for(course),
+        resource=f"users:{course.id}:{enrollment_type}",
+        endpoint=f"courses/{course.id}/users",
+        params=[
+            ("enrollment_type[]", enrollment_type),
+            ("include[]", "email"),
+            ("per_page", cs.CANVAS_PER_PAGE),
+        ],
+    )
+    if records is None:
+        return
+
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "DELETE FROM enrollments WHERE course_id = ? AND enrollment_type = ?",
+            (course.id, enrollment_type),
+        )
+        conn.executemany(
+            "INSERT INTO enrollments (course_id, user_id, enrollment_type, attributes) VALUES (?, ?, ?, ?)",
+            [
+                (course.id, record["id"], enrollment_type, json.dumps(record))
+                for record in records
+            ],
+        )
+
+
+def sync_assignments(course: Course) -> None:
+    records = _sync_list(
+        _requester_for(course),
+        resource=f"assignments:{course.id}",
+        endpoint=f"courses/{course.id}/assignments",
+        params=[("order_by", "due_at"), ("per_page", cs.CANVAS_PER_PAGE)],
+    )
+    if records is None:
+        return
+
+    with closing(_connect()) as conn, conn:
+        conn.execute("DELETE FROM assignments WHERE course_id = ?", (course.id,))
+        conn.executemany(
+            "INSERT INTO assignments (course_id, id, attributes) VALUES (?, ?, ?)",
+            [(course.id, record["id"], json.dumps(record)) for record in records],
+        )
+
+
+def _stored_ids(conn: sqlite3.Connection, course: Course) -> list[list[int]]:
+    """
+    Returns the ids of the assignments and students currently in the store
+    for the course, as `[assignment_ids, user_ids]`.
+    """
+    assignment_ids = conn.execute(
+        "SELECT id FROM assignments WHERE course_id = ? ORDER BY id", (course.id,)
+    ).fetchall()
+    user_ids = conn.execute(
+        "SELECT DISTINCT user_id FROM enrollments WHERE course_id = ? AND enrollment_type = 'student' ORDER BY user_id",
+        (course.id,),
+    ).fetchall()
+
+    return [[id for (id,) in assignment_ids], [id for (id,) in user_ids]]
+
+
+def _needs_full_resync(
+    full_synced_at: str, synced_ids: list, current_ids: list[list[int]]
+) -> bool:
+    if not full_synced_at or len(synced_ids) != 2:
+        return True
+
+    age = datetime.now(timezone.utc) - parse(full_synced_at)
+    if age.total_seconds() >= cs.CANVAS_SUBMISSIONS_RESYNC_SECS:
+        return True
+
+    return any(
+        not set(current).issubset(synced)
+        for current, synced in zip(current_ids, synced_ids)
+    )
+
+
+def sync_submissions(course: Course) -> None:
+    """
+    Brings the course's submissions up to date.
+
+    Only submissions that were submitted or graded since the previous sync
+    are asked for, unless an assignment or student has appeared in the
+    store since the last full sync, or that sync is older than
+    `cs.CANVAS_SUBMISSIONS_RESYNC_SECS`. Then every submission is downloaded
+    again, since unsubmitted placeholders, excusals, and late-policy changes
+    never show up in the deltas. Call this after `sync_users` and
+    `sync_assignments` so that new assignments and students are noticed.
+    """
+    requester = _requester_for(course)
+    resource = f"submissions:{course.id}"
+    full_resource = f"submissions-full:{course.id}"
+    endpoint = f"courses/{course.id}/students/submissions"
+    params = [("student_ids[]", "all"), ("per_page", cs.CANVAS_PER_PAGE)]
+
+    with closing(_connect()) as conn:
+        last_synced_at, _ = _get_sync_state(conn, resource)
+        full_synced_at, synced_ids = _get_sync_state(conn, full_resource)
+        current_ids = _stored_ids(conn, course)
+
+    synced_at = _now()
+    full_resync = not last_synced_at or _needs_full_resync(
+        full_synced_at, synced_ids, current_ids
+    )
+    if full_resync:
+        records, _ = _fetch_all_pages(requester, endpoint, params)
+    else:
+        submitted, _ = _fetch_all_pages(
+            requester, endpoint, [*params, ("submitted_since", last_synced_at)]
+        )
+        graded, _ = _fetch_all_pages(
+            requester, endpoint, [*params, ("graded_since", last_synced_at)]
+        )
+        records = submitted + graded
+
+    with closing(_connect()) as conn, conn:
+        if full_resync:
+            conn.execute("DELETE FROM submissions WHERE course_id = ?", (course.id,))
+            _set_sync_state(conn, full_resource, synced_at, current_ids)
+
+        conn.executemany(
+            "INSERT OR REPLACE INTO submissions (course_id, assignment_id, user_id, attributes) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    course.id,
+                    record["assignment_id"],
+                    record["user_id"],
+                    json.dumps(record),
+                )
+                for record in records
+            ],
+        )
+        _set_sync_state(conn, resource, synced_at, [])
+
+
+def sync_course(course: Course) -> None:
+    sync_users(course)
+    sync_assignments(course)
+    sync_submissions(course)
+
+
+def get_courses(canvas: Canvas, enrolled_as="designer", sync=True) -> list[Course]:
+    if sync:
+        sync_courses(canvas, enrolled_as)
+
+    requester = _requester_for(canvas)
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT attributes FROM courses WHERE enrolled_as = ? ORDER BY rowid",
+            (enrolled_as,),
+        ).fetchall()
+
+    return [Course(requester, json.loads(attributes)) for (attributes,) in rows]
+
+
+def get_users(course: Course, enrollment_type="student", sync=True) -> list[User]:
+    if sync:
+        sync_users(course, enrollment_type)
+
+    requester = _requester_for(course)
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT attributes FROM enrollments WHERE course_id = ? AND enrollment_type = ? ORDER BY rowid",
+            (course.id, enrollment_type),
+        ).fetchall()
+
+    return [User(requester, json.loads(attributes)) for (attributes,) in rows]
+
+
+def get_assignments(course: Course, sync=True) -> list[Assignment]:
+    if sync:
+        sync_assignments(course)
+
+    requester = _requester_for(course)
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT attributes FROM assignments WHERE course_id = ? ORDER BY rowid",
+            (course.id,),
+        ).fetchall()
+
+    return [Assignment(requester, json.loads(attributes)) for (attributes,) in rows]
+
+
+def get_submissions(
+    course: Course,
+    user_ids: list[int] | None = None,
+    assignment_ids: list[int] | None = None,
+    sync=True,
+) -> list[Submission]:
+    if sync:
+        sync_submissions(course)
+
+    query = "SELECT attributes FROM submissions WHERE course_id = ?"
+    params = [course.id]
+    if user_ids is not None:
+        query += f" AND user_id IN ({', '.join('?' * len(user_ids))})"
+        params.extend(user_ids)
+    if assignment_ids is not None:
+        query += f" AND assignment_id IN ({', '.join('?' * len(assignment_ids))})"
+        params.extend(assignment_ids)
+
+    requester = _requester_for(course)
+    with closing(_connect()) as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return [
+        Submission(requester, {"course_id": course.id, **json.loads(attributes)})
+        for (attributes,) in rows
+    ]
+
+
+def is_missing(submission: Submission) -> bool:
+    """
+    Stored submissions keep the `missing` flag from when they were last
+    synced, and Canvas does not report a change when a due date passes.
+    This recomputes the flag from the submission's own due date.
+    """
+    late_policy_status = getattr(submission, "late_policy_status", None)
+    if late_policy_status == "missing":
+        return True
+    if late_policy_status or submission.excused or submission.submitted_at:
+        return False
+
+    due_at = getattr(submission, "cached_due_date", None)
+    if not due_at:
+        return False
+
+    return parse(due_at) < datetime.now(timezone.utc)
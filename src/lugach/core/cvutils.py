@@ -1,19 +1,45 @@
-from datetime import datetime
-
+import hashlib
+import html
+import json
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone, tzinfo
+from itertools import batched
+from typing import Iterable, Iterator
+from urllib.parse import parse_qs, urlencode, urlparse
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import requests
 from canvasapi.page import PaginatedList
 from canvasapi import Canvas
 from canvasapi.assignment import Assignment
 from canvasapi.course import Course
-from canvasapi.exceptions import BadRequest, InvalidAccessToken
+from canvasapi.exceptions import BadRequest, CanvasException, InvalidAccessToken
 from canvasapi.quiz import Quiz
 from canvasapi.user import User
 from dateutil.parser import parse
+from dateutil.tz import tzlocal
 
-from lugach.core import secrets
+import lugach.core.constants as cs
+from lugach.core import cvstore, secrets
+from lugach.core.fanout import FanOutResult, fan_out
+from lugach.core.ratelimit import install_rate_limiter
+from lugach.core.retry import CANVAS_POLICY, install_retries
+from lugach.core.roster import RosterIndex, choose_suggestion
 
 API_URL_SECRET_NAME = "CANVAS_API_URL"
 API_KEY_SECRET_NAME = "CANVAS_API_KEY"
 
+CANVAS_SESSION_PATH = secrets.ROOT_DIR / ".canvas_session"
+COURSE_SIS_IDS_PATH = secrets.ROOT_DIR / "course_sis_ids.json"
+
+_COURSE_SIS_ID_INPUT = re.compile(r'<input[^>]*name="custom_course_sis_id"[^>]*>')
+_INPUT_VALUE = re.compile(r'value="([^"]*)"')
+
 
 def sanitize_string(string: str) -> str:
     """
@@ -59,22 +85,189 @@ def match_course(query: str, course: Course) -> bool:
     return sanitized_query in sanitized_course_name_with_date
 
 
+def _numbered_page_urls(response) -> list[str]:
+    """
+    Returns the URLs of pages 2 through N if the response has a numbered
+    `last` link, or an empty list if Canvas paginates with bookmarks.
+    """
+    last_link = response.links.get("last")
+    if not last_link:
+        return []
+
+    last_url = urlparse(last_link["url"])
+    query = parse_qs(last_url.query)
+    last_page = query.get("page", [""])[0]
+    if not last_page.isdigit():
+        return []
+
+    return [
+        last_url._replace(query=urlencode({**query, "page": page}, doseq=True)).geturl()
+        for page in range(2, int(last_page) + 1)
+    ]
+
+
+def iter_prefetched(paginated_list: PaginatedList, parallel=True) -> Iterator:
+    """
+    Iterates over a PaginatedList while fetching ahead of the caller.
+
+    Page N + 1 is requested while page N is being consumed. If `parallel` is
+    set and Canvas reports the number of the last page, every remaining page
+    is instead requested at once as soon as the first one arrives. Elements
+    are yielded in their original order either way, and unlike iterating the
+    PaginatedList itself, pages are not kept after they are consumed.
+    """
+    # These are canvasapi internals (pinned in pyproject.toml). If a release
+    # renames them, fall back to fetching one page at a time.
+    try:
+        requester = paginated_list._requester
+        method = paginated_list._request_method
+        first_url = paginated_list._first_url
+        first_params = paginated_list._first_params
+        root = paginated_list._root
+        extra_attribs = paginated_list._extra_attribs
+        content_class = paginated_list._content_class
+    except AttributeError:
+        yield from paginated_list
+        return
+
+    def elements_of(response) -> list:
+        data = response.json()
+        if root:
+            data = data[root]
+
+        elements = []
+        for element in data:
+            if element is not None:
+                element.update(extra_attribs or {})
+                elements.append(content_class(requester, element))
+
+        return elements
+
+    def get(url):
+        return requester.request(method, _url=url)
+
+    response = requester.request(
+        method,
+        first_url,
+        _url=getattr(paginated_list, "_url_override", None),
+        **first_params,
+    )
+
+    page_urls = _numbered_page_urls(response) if parallel else []
+    if page_urls:
+        with ThreadPoolExecutor(max_workers=cs.MAX_WORKERS) as executor:
+            page_responses = executor.map(get, page_urls)
+            yield from elements_of(response)
+            for page_response in page_responses:
+                yield from elements_of(page_response)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            next_link = response.links.get("next")
+            next_response = next_link and executor.submit(get, next_link["url"])
+
+            yield from elements_of(response)
+            if not next_response:
+                return
+
+            response = next_response.result()
+
+
+def _canvas_session_fingerprint(api_url: str, api_key: str) -> str:
+    return hashlib.sha256(f"{api_url}\n{api_key}".encode("utf-8")).hexdigest()
+
+
+def _canvas_session_is_fresh(fingerprint: str) -> bool:
+    try:
+        session = json.loads(CANVAS_SESSION_PATH.read_text())
+    except (FileNotFoundError, ValueError):
+        return False
+
+    if session.get("fingerprint") != fingerprint:
+        return False
+
+    validated_at = session.get("validated_at", 0)
+    return time.time() - validated_at < cs.CANVAS_SESSION_TTL_SECS
+
+
+def _record_canvas_session(fingerprint: str) -> None:
+    session = {"fingerprint": fingerprint, "validated_at": time.time()}
+    CANVAS_SESSION_PATH.write_text(json.dumps(session))
+    try:
+        CANVAS_SESSION_PATH.chmod(0o600)
+    except PermissionError:
+        pass
+
+
+def invalidate_canvas_session() -> None:
+    """
+    Forgets that the stored API key was validated, so that the next call to
+    `create_canvas_object` probes Canvas again.
+    """
+    CANVAS_SESSION_PATH.unlink(missing_ok=True)
+
+
 def create_canvas_object() -> Canvas:
+    """
+    Creates a Canvas object from the URL and API key stored in the .env file.
+
+    The key is only probed against Canvas if it has not been confirmed good
+    within the last `CANVAS_SESSION_TTL_SECS` seconds. Otherwise, a revoked
+    key surfaces as `InvalidAccessToken` on the first real request.
+
+    Returns
+    -------
+    [Canvas](https://canvasapi.readthedocs.io/en/stable/canvas-ref.html)
+        Provides access to the Canvas API.
+    """
     API_URL = secrets.get_secret(API_URL_SECRET_NAME)
     API_KEY = secrets.get_secret(API_KEY_SECRET_NAME)
     if not API_URL or not API_KEY:
         raise NameError("Failed to load URL and key from .env file.")
 
+    canvas = Canvas(API_URL, API_KEY)
+    install_rate_limiter(canvas)
+    install_retries(canvas._Canvas__requester._session, CANVAS_POLICY)
+
+    fingerprint = _canvas_session_fingerprint(API_URL, API_KEY)
+    if _canvas_session_is_fresh(fingerprint):
+        return canvas
+
     try:
-        canvas = Canvas(API_URL, API_KEY)
         canvas.get_courses()[0]
     except InvalidAccessToken as e:
+        invalidate_canvas_session()
         message = "You entered an invalid API key in the .env file."
         raise InvalidAccessToken(message) from e
 
+    _record_canvas_session(fingerprint)
     return canvas
 
 
+@contextmanager
+def count_requests(course: Course) -> Iterator[Counter]:
+    """
+    Counts the HTTP requests made through a course's requester (from any
+    thread) while the context is open, under the "requests" key.
+    """
+    requester = course._requester
+    counter = Counter()
+    lock = threading.Lock()
+    request = requester.request
+
+    def counted_request(*args, **kwargs):
+        with lock:
+            counter["requests"] += 1
+        return request(*args, **kwargs)
+
+    requester.request = counted_request
+    try:
+        yield counter
+    finally:
+        del requester.request
+
+
 def get_courses(canvas: Canvas, enrolled_as="designer", **kwargs) -> PaginatedList:
     courses = canvas.get_courses(enrollment_type=enrolled_as, **kwargs)
 
@@ -88,7 +281,7 @@ def filter_courses_by_query(courses: list[Course], query: str) -> list[Course]:
     return course_results
 
 
-def prompt_for_course(canvas: Canvas) -> Course:
+def prompt_for_course(canvas: Canvas, use_store=False) -> Course:
     """
     Uses a simple command line interface to prompt the user to choose a modifiable course.
     In order for a user to select a course, they must be added as a Designer to the course in Canvas.
@@ -99,13 +292,21 @@ def prompt_for_course(canvas: Canvas) -> Course:
     `canvas`: [Canvas](https://canvasapi.readthedocs.io/en/stable/canvas-ref.html).
         Provides access to the Canvas API, from which the function collects course data.
 
+    `use_store`: bool
+        Whether to read the courses from the local snapshot (see `cvstore`)
+        instead of downloading them again.
+
     Returns
     -------
     [Course](https://canvasapi.readthedocs.io/en/stable/course-ref.html)
         Points to the course the user chose.
     """
 
-    all_course_results = [course for course in get_courses(canvas) if course.start_at]
+    if use_store:
+        courses = cvstore.get_courses(canvas)
+    else:
+        courses = iter_prefetched(get_courses(canvas))
+    all_course_results = [course for course in courses if course.start_at]
     course_results = all_course_results
 
     while True:
@@ -156,7 +357,103 @@ def process_bad_request(e: BadRequest) -> bool:
     return True
 
 
-def prompt_for_student(course: Course) -> User:
+def get_student_roster_index(course: Course, use_store=False) -> RosterIndex[User]:
+    """
+    Builds a `RosterIndex` over the students in a course, so that any number
+    of name searches can be answered without further requests.
+    """
+    if use_store:
+        students = cvstore.get_users(course)
+    else:
+        students = iter_prefetched(course.get_users(enrollment_type="student"))
+
+    return RosterIndex(students, name_of=lambda student: student.name)
+
+
+def prompt_for_courses(canvas: Canvas, use_store=False) -> list[Course]:
+    """
+    Prompts the user to choose courses one at a time (see `prompt_for_course`)
+    until they are done.
+    """
+    courses = {}
+    while True:
+        course = prompt_for_course(canvas, use_store=use_store)
+        courses[course.id] = course
+
+        print()
+        add_another = input("Would you like to add another course (y/n)? ")
+        if add_another != "y":
+            return list(courses.values())
+
+
+def _load_course_sis_ids() -> dict[str, str]:
+    try:
+        return json.loads(COURSE_SIS_IDS_PATH.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _get_course_sis_id_from_launch(course: Course) -> str | None:
+    """
+    Reads the SIS id that Canvas sends to the Lighthouse external tool, from
+    the launch form of a sessionless launch.
+    """
+    requester = course._requester
+    try:
+        launch = requester.request(
+            "GET",
+            f"courses/{course.id}/external_tools/sessionless_launch",
+            id=cs.LH_EXTERNAL_TOOL_ID,
+        ).json()
+    except CanvasException:
+        return None
+
+    response = requester._session.get(launch["url"], timeout=cs.LH_TIMEOUT_SECS)
+    input_tag = _COURSE_SIS_ID_INPUT.search(response.text)
+    value = input_tag and _INPUT_VALUE.search(input_tag.group(0))
+
+    return html.unescape(value.group(1)) if value else None
+
+
+def get_course_sis_id(course: Course) -> str:
+    """
+    Finds the course's SIS id (as used by Lighthouse) without a browser.
+
+    The course's `sis_course_id` is used when Canvas includes it, which
+    depends on the user's permissions. Otherwise the id is read from a
+    sessionless launch of the Lighthouse tool. Either way, the id is saved
+    in `COURSE_SIS_IDS_PATH` so later runs need no requests at all.
+
+    Parameters
+    ----------
+    `course`: [Course](https://canvasapi.readthedocs.io/en/stable/course-ref.html)
+        The course to find the SIS id of.
+
+    Returns
+    -------
+    str
+        The course's SIS id.
+    """
+    course_sis_ids = _load_course_sis_ids()
+    course_sis_id = course_sis_ids.get(str(course.id))
+    if course_sis_id:
+        return course_sis_id
+
+    course_sis_id = getattr(
+        course, "sis_course_id", None
+    ) or _get_course_sis_id_from_launch(course)
+    if not course_sis_id:
+        raise ValueError(f"Could not determine the SIS id of {course.name}.")
+
+    course_sis_ids[str(course.id)] = course_sis_id
+    COURSE_SIS_IDS_PATH.write_text(json.dumps(course_sis_ids), encoding="utf-8")
+
+    return course_sis_id
+
+
+def prompt_for_student(
+    course: Course, use_store=False, roster_index: RosterIndex[User] | None = None
+) -> User:
     """
     Uses a simple command line interface to prompt the user to choose a student from a given course.
 
@@ -165,37 +462,50 @@ def prompt_for_student(course: Course) -> User:
     `course`: [Course](https://canvasapi.readthedocs.io/en/stable/course-ref.html)
         The course to pull student information from.
 
+    `use_store`: bool
+        Whether to read the roster from the local snapshot (see `cvstore`)
+        instead of downloading it.
+
+    `roster_index`: RosterIndex
+        A prebuilt index over the course's students (see
+        `get_student_roster_index`), for prompting several times without
+        rebuilding it.
+
     Returns
     -------
     [User](https://canvasapi.readthedocs.io/en/stable/user-ref.html)
         Points to the student the user chose.
     """
 
-    source = course
+    if roster_index is None:
+        roster_index = get_student_roster_index(course, use_store)
+    matches = None
     while True:
-        while True:
-            try:
-                query = input("Search for the student by name: ")
-                source = filter_users_by_query(source, query)
-                break
-            except BadRequest as e:
-                process_bad_request(e)
-
-        source_len = len(source)
-        if source_len == 0:
+        query = input("Search for the student by name: ")
+        within = matches
+        matches = roster_index.search_indices(query, within=within)
+
+        matches_len = len(matches)
+        if matches_len == 0:
+            suggestion = choose_suggestion(roster_index, query, within=within)
+            if suggestion is not None:
+                print(f"\nYou chose {suggestion.name}.")
+                return suggestion
+
             print("\nNo such student was found.")
-            source = course
+            matches = None
             continue
-        elif source_len == 1:
-            selected_student = source[0]
+        elif matches_len == 1:
+            selected_student = roster_index.entries[matches[0]]
             print(f"\nYou chose {selected_student.name}.")
             return selected_student
 
-        print(f"\nYour query returned {source_len} students.")
+        print(f"\nYour query returned {matches_len} students.")
         print("Here are their names:\n")
-        for student in source:
-            print(f"    {student.name}")
+        for i in matches:
+            print(f"    {roster_index.entries[i].name}")
         print()
+        matches = set(matches)
 
 
 def filter_assignments_by_query(
@@ -280,6 +590,101 @@ def set_time_limits_for_quizzes(
         set_time_limit_for_quiz(student, quiz, time_multiplier)
 
 
+def _set_bulk_time_limit_for_quiz(
+    quiz: Quiz, accommodations: list[tuple[User, float]]
+) -> float:
+    start = time.perf_counter()
+    quiz.set_extensions(
+        [
+            {"user_id": student.id, "extra_time": quiz.time_limit * time_multiplier}
+            for student, time_multiplier in accommodations
+        ]
+    )
+    return time.perf_counter() - start
+
+
+def set_time_limits_for_quizzes_in_bulk(
+    course: Course,
+    accommodations: list[tuple[User, float]],
+    max_workers=cs.MAX_WORKERS,
+) -> None:
+    """
+    Updates the time limit extensions for all timed quizzes in the given course
+    for every accommodated student at once. Each quiz gets a single
+    `set_extensions` request covering all of the students, and the quizzes
+    are updated concurrently.
+
+    Parameters
+    ----------
+    `course`: [Course](https://canvasapi.readthedocs.io/en/stable/course-ref.html)
+        The course to pull quiz information from.
+
+    `accommodations`: list[tuple[User, float]]
+        Pairs of a student and the proportion of each quiz's time limit that
+        should be added as their extension.
+
+    `max_workers`: int
+        The most quizzes to update at the same time.
+    """
+
+    quizzes = [quiz for quiz in course.get_quizzes() if quiz.time_limit]
+    if not quizzes or not accommodations:
+        print("There are no timed quizzes or accommodated students to update.")
+        return
+
+    print(
+        f"Updating {len(quizzes)} quizzes for {len(accommodations)} students "
+        f"({max_workers} at a time)..."
+    )
+
+    start = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_set_bulk_time_limit_for_quiz, quiz, accommodations): quiz
+            for quiz in quizzes
+        }
+        for future in as_completed(futures):
+            quiz = futures[future]
+            try:
+                elapsed = future.result()
+                print(
+                    f"    {quiz.title:40.40} | {quiz.time_limit:4} min | {elapsed:6.2f}s"
+                )
+            except (CanvasException, requests.RequestException) as e:
+                # Includes `retry.CircuitOpenError`, a `ConnectionError`.
+                failures += 1
+                print(f"    {quiz.title:40.40} | failed: {e}")
+
+    total_elapsed = time.perf_counter() - start
+    print(
+        f"Updated {len(quizzes) - failures} of {len(quizzes)} quizzes in {total_elapsed:.2f}s."
+    )
+
+
+def get_course_time_zone(course: Course) -> tzinfo:
+    """
+    Returns the course's time zone, or the computer's if Canvas did not
+    send one that Python knows.
+    """
+    try:
+        return ZoneInfo(course.time_zone)
+    except (AttributeError, TypeError, ValueError, ZoneInfoNotFoundError):
+        return tzlocal()
+
+
+def shift_date(value: str, days: int, time_zone: tzinfo) -> str:
+    """
+    Moves an ISO 8601 date by `days` on the wall clock of `time_zone`, so
+    that the local time of day stays the same across a daylight saving
+    change, and returns it in UTC.
+    """
+    local_date = parse(value).astimezone(time_zone)
+    # Arithmetic between datetimes that share a tzinfo is wall-clock time.
+    shifted_date = local_date + timedelta(days=days)
+    return shifted_date.astimezone(timezone.utc).isoformat()
+
+
 def get_assignment_or_quiz_due_date(course: Course, assignment: Assignment) -> datetime:
     if assignment.is_quiz_assignment:
         quiz_id = assignment.quiz_id
@@ -289,3 +694,132 @@ def get_assignment_or_quiz_due_date(course: Course, assignment: Assignment) -> d
         due_date = parse(assignment.due_at)
 
     return due_date
+
+
+def get_due_dates_by_assignment(
+    course: Course,
+    assignments: list[Assignment],
+    quizzes_by_id: dict[int, Quiz] | None = None,
+) -> dict[int, datetime | None]:
+    """
+    Looks up the current due date of each assignment, using one prefetched
+    list of the course's quizzes instead of a `get_quiz` request per quiz.
+
+    Parameters
+    ----------
+    `quizzes_by_id`: dict[int, Quiz] | None
+        The course's quizzes by id, if the caller has already fetched them.
+
+    Returns
+    -------
+    dict[int, datetime | None]
+        The due date of each assignment by assignment id, or None for
+        assignments without one.
+    """
+    if quizzes_by_id is None:
+        quizzes_by_id = {}
+        if any(assignment.is_quiz_assignment for assignment in assignments):
+            quizzes_by_id = {quiz.id: quiz for quiz in course.get_quizzes()}
+
+    due_dates = {}
+    for assignment in assignments:
+        due_at = assignment.due_at
+        quiz = quizzes_by_id.get(getattr(assignment, "quiz_id", None))
+        if assignment.is_quiz_assignment and quiz:
+            due_at = quiz.due_at
+
+        due_dates[assignment.id] = parse(due_at) if due_at else None
+
+    return due_dates
+
+
+def get_overridden_student_ids(
+    course: Course, assignment_ids: Iterable[int]
+) -> dict[int, set[int]]:
+    """
+    Returns the ids of the students who already have an individual (adhoc)
+    override on each of the given assignments, fetching them all at once.
+    """
+    assignment_ids = list(assignment_ids)
+    results = fan_out(
+        assignment_ids,
+        lambda assignment_id: list(
+            Assignment(
+                course._requester, {"id": assignment_id, "course_id": course.id}
+            ).get_overrides()
+        ),
+    )
+
+    overridden_student_ids = {}
+    for result in results:
+        if result.error:
+            raise result.error
+
+        overridden_student_ids[result.item] = {
+            student_id
+            for override in result.value
+            for student_id in getattr(override, "student_ids", None) or []
+        }
+
+    return overridden_student_ids
+
+
+def create_overrides_in_bulk(
+    course: Course, assignment_overrides: list[dict]
+) -> tuple[list[FanOutResult], dict[int, list[int]]]:
+    """
+    Creates assignment overrides through Canvas's batch override endpoint,
+    sending `cs.OVERRIDE_BATCH_SIZE` overrides per request and several
+    requests at once.
+
+    Canvas rejects a whole batch if any student in it already has an
+    individual override on that assignment, so those students are left out
+    of the overrides and reported instead.
+
+    Parameters
+    ----------
+    `course`: [Course](https://canvasapi.readthedocs.io/en/stable/course-ref.html)
+        The course the assignments belong to.
+
+    `assignment_overrides`: list[dict]
+        The overrides to create. Each needs an `assignment_id` as well as the
+        usual override attributes (`student_ids`, `due_at`, etc.).
+
+    Returns
+    -------
+    tuple[list[FanOutResult], dict[int, list[int]]]
+        One result per batch, and the ids of the students left out of each
+        assignment's override because they already had one. Canvas creates
+        each batch in a transaction, so a batch that Canvas rejected (a
+        `CanvasException`) created none of its overrides. A batch that failed
+        with a `requests.RequestException` may still have been applied.
+    """
+    overridden_student_ids = get_overridden_student_ids(
+        course, {override["assignment_id"] for override in assignment_overrides}
+    )
+
+    overrides_to_create = []
+    skipped_student_ids = {}
+    for override in assignment_overrides:
+        assignment_id = override["assignment_id"]
+        already_overridden = overridden_student_ids[assignment_id]
+        student_ids = [
+            id for id in override["student_ids"] if id not in already_overridden
+        ]
+        skipped = [id for id in override["student_ids"] if id in already_overridden]
+        if skipped:
+            skipped_student_ids[assignment_id] = skipped
+        if student_ids:
+            overrides_to_create.append({**override, "student_ids": student_ids})
+
+    batches = list(batched(overrides_to_create, cs.OVERRIDE_BATCH_SIZE))
+    # The endpoint's response is paginated lazily, so it must be read here
+    # for the request to be sent and any error to surface. A batch still
+    # running at a timeout may yet be applied, so wait for every one.
+    results = fan_out(
+        batches,
+        lambda batch: list(course.create_assignment_overrides(list(batch))),
+        timeout=None,
+    )
+
+    return results, skipped_student_ids
@@ -0,0 +1,99 @@
+"""
+Runs the same operation across many courses (or any other items) at once.
+
+`fan_out` is meant for work that is dominated by waiting on Canvas or Top Hat,
+such as searching every selected section for a student. Results come back in
+the same order as the items, and a failure or timeout in one task is reported
+in its result rather than interrupting the others.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, NamedTuple
+
+import lugach.core.constants as cs
+
+_POLL_SECS = 0.1
+
+
+class FanOutResult(NamedTuple):
+    item: Any
+    value: Any
+    error: Exception | None
+    elapsed: float
+
+
+def fan_out[T](
+    items: Iterable[T],
+    task: Callable[[T], Any],
+    max_workers=cs.MAX_WORKERS,
+    timeout: float | None = cs.FAN_OUT_TIMEOUT_SECS,
+) -> list[FanOutResult]:
+    """
+    Calls `task` on each item with at most `max_workers` calls running at
+    once.
+
+    Parameters
+    ----------
+    `items`: Iterable
+        The items to run the task on, usually canvasapi `Course` objects or
+        Top Hat course dicts.
+
+    `task`: Callable
+        The per-item operation.
+
+    `max_workers`: int
+        The most tasks to run at the same time.
+
+    `timeout`: float | None
+        The seconds a task may run before its result is reported as a
+        `TimeoutError`. The task's thread is abandoned rather than killed, so
+        it keeps its worker slot until it finishes.
+
+    Returns
+    -------
+    list[FanOutResult]
+        One result per item, in the same order as `items`.
+    """
+    items = list(items)
+    results: list[FanOutResult | None] = [None] * len(items)
+    started_at: dict[int, float] = {}
+
+    def run(i: int) -> tuple[Any, float]:
+        started_at[i] = time.monotonic()
+        value = task(items[i])
+        return value, time.monotonic() - started_at[i]
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    futures = {executor.submit(run, i): i for i in range(len(items))}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=_POLL_SECS, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                i = futures[future]
+                try:
+                    value, elapsed = future.result()
+                    results[i] = FanOutResult(items[i], value, None, elapsed)
+                except Exception as e:
+                    elapsed = time.monotonic() - started_at.get(i, time.monotonic())
+                    results[i] = FanOutResult(items[i], None, e, elapsed)
+
+            if timeout is None:
+                continue
+
+            now = time.monotonic()
+            for future in list(pending):
+                i = futures[future]
+                if i in started_at and now - started_at[i] > timeout:
+                    pending.remove(future)
+                    error = TimeoutError(f"Task did not finish within {timeout}s.")
+                    results[i] = FanOutResult(
+                        items[i], None, error, now - started_at[i]
+                    )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
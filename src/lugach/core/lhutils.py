@@ -1,5 +1,11 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
 import requests
 import lugach.core.constants as cs
+import lugach.core.cvutils as cvu
 
 from canvasapi.course import Course
 
@@ -8,11 +14,25 @@ from getpass import getpass
 from selenium import webdriver
 from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
-from lugach.core.secrets import get_credentials, set_credentials
+from lugach.core.fanout import FanOutResult, fan_out
+from lugach.core.retry import LH_POLICY, install_retries
+from lugach.core.secrets import (
+    ROOT_DIR,
+    get_credentials,
+    get_secret,
+    set_credentials,
+    update_env_file,
+)
 
 CREDENTIALS_ID = "LU_LIGHTHOUSE"
+TOKEN_SECRET_NAME = "LH_ACCESS_TOKEN"
+TOKEN_EXP_SECRET_NAME = "LH_ACCESS_TOKEN_EXP"
+FINAL_GRADES_JOURNAL_PATH = ROOT_DIR / "final_grades_journal.jsonl"
+
+_journal_lock = threading.Lock()
 
 
 def get_liberty_credentials() -> tuple[str, str]:
@@ -38,85 +58,248 @@ def prompt_user_for_liberty_credentials():
             username = input("Enter your Liberty username: ")
             password = getpass("Enter your Liberty password: ")
             set_credentials(id=CREDENTIALS_ID, username=username, password=password)
+            invalidate_lh_token()
 
 
-def get_lh_auth_credentials_for_session(
-    course: Course, liberty_username: str, liberty_password: str
-) -> tuple[str, dict[str, str]]:
-    course_id = course.id
+def _get_cached_lh_token() -> str | None:
+    """
+    Returns the Lighthouse access token saved by the last browser login if
+    it is not within `cs.LH_TOKEN_REFRESH_MARGIN_SECS` of expiring.
+    """
+    try:
+        access_token = get_secret(TOKEN_SECRET_NAME)
+        exp = float(get_secret(TOKEN_EXP_SECRET_NAME))
+    except (NameError, ValueError):
+        return None
 
-    options = webdriver.ChromeOptions()
-    driver = webdriver.Chrome(options=options)
-    driver.implicitly_wait(cs.GLOBAL_TIMEOUT_SECS)
-    wait = WebDriverWait(driver, timeout=cs.GLOBAL_TIMEOUT_SECS)
+    if exp - cs.LH_TOKEN_REFRESH_MARGIN_SECS <= time.time():
+        return None
 
-    driver.get(f"https://canvas.liberty.edu/courses/{course_id}/external_tools/183/")
+    return access_token
 
-    username_input = driver.find_element(by=By.ID, value="i0116")
-    username_input.send_keys(liberty_username)
-    password_input = driver.find_element(by=By.ID, value="i0118")
-    password_input.send_keys(liberty_password)
 
-    submit = driver.find_element(by=By.ID, value="idSIButton9")
-    wait.until(lambda d: submit.get_attribute("value") == "Next")
-    submit.click()
+def _cache_lh_token(access_token: str, exp: float) -> None:
+    update_env_file(
+        **{
+            TOKEN_SECRET_NAME: access_token,
+            TOKEN_EXP_SECRET_NAME: str(exp),
+        }
+    )
 
-    for i in range(1, cs.RELOAD_ATTEMPTS + 1):
-        try:
-            submit = driver.find_element(by=By.ID, value="idSIButton9")
-            wait.until(lambda d: submit.get_attribute("value") == "Sign in")
-            submit.click()
-            break
-        except (StaleElementReferenceException, TimeoutException):
-            print(
-                f"Failed to submit form, retrying... ({i} of {cs.RELOAD_ATTEMPTS} attempts so far)"
-            )
-    else:
-        driver.quit()
-        raise PermissionError("Failed to load authentication header.")
 
-    wait.until(lambda d: "canvas" in d.current_url)
-    course_sis_id_element = driver.find_element(by=By.ID, value="custom_course_sis_id")
+def invalidate_lh_token() -> None:
+    _cache_lh_token("", 0)
 
-    course_sis_id = course_sis_id_element.get_attribute("value")
-    if course_sis_id is None:
-        raise ValueError("Could not determine course_sis_id.")
 
-    driver.get("https://lighthouse.okd.liberty.edu/")
-    wait.until(lambda d: d.get_cookie("access_token"))
+def _create_driver() -> webdriver.Chrome:
+    """
+    Starts Chrome for logging in. Unless `cs.LH_HEADLESS` is off, the window
+    is hidden, images are not loaded, and pages count as loaded as soon as
+    their HTML is parsed, since only the login form and cookies are needed.
+    """
+    options = webdriver.ChromeOptions()
+    if cs.LH_HEADLESS:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1280,800")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2}
+    )
+    options.page_load_strategy = "eager"
+
+    return webdriver.Chrome(options=options)
+
+
+def _log_in_with_browser(
+    course: Course, liberty_username: str, liberty_password: str
+) -> tuple[str, float]:
+    """
+    Logs into Lighthouse through the course's Canvas external tool, returning
+    the access token and its expiry.
+    """
+    course_id = course.id
+
+    driver = _create_driver()
+    wait = WebDriverWait(driver, timeout=cs.GLOBAL_TIMEOUT_SECS)
+
+    try:
+        driver.get(
+            f"https://canvas.liberty.edu/courses/{course_id}/external_tools/{cs.LH_EXTERNAL_TOOL_ID}/"
+        )
 
-    access_token_cookie = driver.get_cookie("access_token")
-    if access_token_cookie is None:
-        raise PermissionError("Could not retrieve access token cookie.")
+        username_input = wait.until(EC.presence_of_element_located((By.ID, "i0116")))
+        username_input.send_keys(liberty_username)
+        password_input = wait.until(EC.presence_of_element_located((By.ID, "i0118")))
+        password_input.send_keys(liberty_password)
+
+        submit = wait.until(EC.element_to_be_clickable((By.ID, "idSIButton9")))
+        wait.until(lambda d: submit.get_attribute("value") == "Next")
+        submit.click()
+
+        for i in range(1, cs.RELOAD_ATTEMPTS + 1):
+            try:
+                submit = wait.until(EC.element_to_be_clickable((By.ID, "idSIButton9")))
+                wait.until(lambda d: submit.get_attribute("value") == "Sign in")
+                submit.click()
+                break
+            except (StaleElementReferenceException, TimeoutException):
+                print(
+                    f"Failed to submit form, retrying... ({i} of {cs.RELOAD_ATTEMPTS} attempts so far)"
+                )
+        else:
+            raise PermissionError("Failed to load authentication header.")
+
+        # The tool's launch form has loaded once its parameters are present.
+        wait.until(lambda d: "canvas" in d.current_url)
+        wait.until(EC.presence_of_element_located((By.ID, "custom_course_sis_id")))
+
+        driver.get("https://lighthouse.okd.liberty.edu/")
+        wait.until(lambda d: d.get_cookie("access_token"))
+
+        access_token_cookie = driver.get_cookie("access_token")
+        if access_token_cookie is None:
+            raise PermissionError("Could not retrieve access token cookie.")
+    finally:
+        driver.quit()
 
     access_token = access_token_cookie["value"]
+    exp = access_token_cookie.get("expiry") or time.time() + cs.LH_TOKEN_TTL_SECS
+
+    return access_token, exp
+
+
+class LighthouseClient:
+    """
+    Sends Lighthouse requests over one keep-alive session with the cached
+    access token. The token is not tied to a course, so one client serves
+    every course in a batch. If Lighthouse rejects the token with a 401, the
+    client logs in again through the browser (using `course`'s tool page)
+    and retries the request once. Other failures are retried under
+    `retry.LH_POLICY`.
+    """
+
+    def __init__(self, course: Course, access_token: str):
+        self.course = course
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+        install_retries(self.session, LH_POLICY)
+        self._auth_lock = threading.Lock()
+
+    def refresh(self, rejected_authorization: str) -> None:
+        with self._auth_lock:
+            # Another thread may have logged in again while this one waited.
+            if self.session.headers.get("Authorization") != rejected_authorization:
+                return
+
+            username, password = get_liberty_credentials()
+            access_token, exp = _log_in_with_browser(self.course, username, password)
+            _cache_lh_token(access_token, exp)
+            self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        authorization = self.session.headers.get("Authorization")
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 401:
+            self.refresh(authorization)
+            response = self.session.request(method, url, **kwargs)
+
+        return response
+
+
+def create_lh_client(
+    course: Course, liberty_username: str, liberty_password: str
+) -> LighthouseClient:
+    """
+    Returns a client for Lighthouse, only starting the browser (through
+    `course`'s tool page) when there is no unexpired cached token.
+    """
+    start = time.perf_counter()
+
+    access_token = _get_cached_lh_token()
+    if access_token:
+        source = "cached token"
+    else:
+        access_token, exp = _log_in_with_browser(
+            course, liberty_username, liberty_password
+        )
+        _cache_lh_token(access_token, exp)
+        source = "browser login"
 
-    driver.quit()
+    print(f"Signed into Lighthouse in {time.perf_counter() - start:.2f}s ({source}).")
+    return LighthouseClient(course, access_token)
 
-    lh_auth_header = {"Authorization": f"Bearer {access_token}"}
-    return course_sis_id, lh_auth_header
 
+def get_lh_auth_credentials_for_session(
+    course: Course, liberty_username: str, liberty_password: str
+) -> tuple[str, LighthouseClient]:
+    course_sis_id = cvu.get_course_sis_id(course)
+    lh_client = create_lh_client(course, liberty_username, liberty_password)
 
-def get_lh_students(course_sis_id: str, lh_auth_header: dict[str, str]) -> list[dict]:
-    students_url = f"https://lighthouse.okd.liberty.edu/rest/courses/{course_sis_id}/enrollments?courseSisId={course_sis_id}&sis=banner&lms=canvas_lu"
+    return course_sis_id, lh_client
 
-    for i in range(1, cs.RELOAD_ATTEMPTS + 1):
-        response = requests.get(url=students_url, headers=lh_auth_header)
-        if response.status_code != 200:
-            print(
-                f"{response.request.method} request returned with code {response.status_code}; retrying... ({i} of {cs.RELOAD_ATTEMPTS} attempts so far)"
-            )
-            continue
 
-        break
-    else:
-        raise PermissionError("Failed to log into Lighthouse.")
+def get_lh_students(course_sis_id: str, lh_client: LighthouseClient) -> list[dict]:
+    students_url = f"https://lighthouse.okd.liberty.edu/rest/courses/{course_sis_id}/enrollments?courseSisId={course_sis_id}&sis=banner&lms=canvas_lu"
+
+    response = lh_client.request("GET", students_url)
+    if response.status_code != 200:
+        raise PermissionError(
+            f"{response.request.method} request returned with code {response.status_code}."
+        )
 
     students = response.json()
     return students
 
 
-def post_final_grade(course_sis_id, lh_auth_header, student, grade):
+def _journal_final_grade_attempt(
+    course_sis_id: str,
+    student: dict,
+    grade: str,
+    status: str,
+    error: str | None = None,
+) -> None:
+    entry = {
+        "attempted_at": datetime.now(timezone.utc).isoformat(),
+        "course_sis_id": course_sis_id,
+        "enrollment_id": student["id"],
+        "grade": grade,
+        "status": status,
+        "error": error,
+    }
+    with _journal_lock, open(FINAL_GRADES_JOURNAL_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def get_posted_enrollment_ids(course_sis_id: str) -> set:
+    """
+    Returns the ids of the enrollments in the course whose final grade the
+    journal records as posted.
+    """
+    posted = set()
+    try:
+        with open(FINAL_GRADES_JOURNAL_PATH, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash
+
+                if (
+                    entry.get("course_sis_id") == course_sis_id
+                    and entry.get("status") == "posted"
+                ):
+                    posted.add(entry["enrollment_id"])
+    except FileNotFoundError:
+        pass
+
+    return posted
+
+
+def post_final_grade(course_sis_id, lh_client, student, grade):
+    """
+    Posts one final grade (retried under `retry.LH_POLICY`) and journals
+    whether it was posted.
+    """
     if grade not in ["A", "B", "C", "D", "F"]:
         raise TypeError(
             "Expected a letter grade (A, B, C, D, or F) for the grade parameter."
@@ -126,16 +309,94 @@ def post_final_grade(course_sis_id, lh_auth_header, student, grade):
     grades_url = f"https://lighthouse.okd.liberty.edu/rest/enrollments/{id}/grade?courseSisId={course_sis_id}&sis=banner&lms=canvas_lu"
     payload = {"grade": grade}
 
-    for i in range(1, cs.RELOAD_ATTEMPTS + 1):
-        response = requests.post(url=grades_url, json=payload, headers=lh_auth_header)
-        if response.status_code != 200:
-            print(
-                f"{response.request.method} request returned with code {response.status_code}; retrying... ({i} of {cs.RELOAD_ATTEMPTS} attempts so far)"
-            )
-            continue
+    # Posting a grade sets it outright, so sending it twice is harmless.
+    try:
+        response = lh_client.request("POST", grades_url, json=payload, idempotent=True)
+    except requests.RequestException as e:
+        _journal_final_grade_attempt(course_sis_id, student, grade, "failed", str(e))
+        raise
 
-        break
-    else:
-        raise PermissionError("Failed to log into Lighthouse.")
+    if response.status_code != 200:
+        error = f"{response.request.method} request returned with code {response.status_code}"
+        _journal_final_grade_attempt(course_sis_id, student, grade, "failed", error)
+        raise PermissionError(f"Failed to post final grade: {error}.")
+
+    _journal_final_grade_attempt(course_sis_id, student, grade, "posted")
+    return True
+
+
+def post_attendance_verification(
+    course_sis_id: str, lh_client: LighthouseClient, student: dict
+) -> bool:
+    """
+    Marks one enrollment as attended, retrying under `retry.LH_POLICY`.
+    """
+    attendance_url = f"https://lighthouse.okd.liberty.edu/rest/enrollments/{student['id']}/attendance?courseSisId={course_sis_id}&sis=banner&lms=canvas_lu"
+    payload = {"attendance": "ATTENDED"}
+
+    response = lh_client.request("POST", attendance_url, json=payload, idempotent=True)
+    if response.status_code != 200:
+        raise PermissionError(
+            f"Failed to update attendance: {response.request.method} request "
+            f"returned with code {response.status_code}."
+        )
 
     return True
+
+
+def post_final_grades_in_bulk(
+    course_sis_id: str,
+    lh_client: LighthouseClient,
+    grades: list[tuple[dict, str]],
+    max_workers=cs.LH_MAX_WORKERS,
+) -> list[FanOutResult]:
+    """
+    Posts many final grades at once, skipping any that the journal shows were
+    already posted (e.g. by a run that was interrupted), and prints a summary.
+
+    Parameters
+    ----------
+    `course_sis_id`: str
+        The SIS id of the course, from `cvutils.get_course_sis_id`.
+
+    `lh_client`: LighthouseClient
+        The client to post with.
+
+    `grades`: list[tuple[dict, str]]
+        Each Lighthouse enrollment with the letter grade to post for it.
+
+    `max_workers`: int
+        The most grades to post at the same time.
+
+    Returns
+    -------
+    list[FanOutResult]
+        One result per grade that was not already posted, with `error` set for
+        any that failed.
+    """
+    posted = get_posted_enrollment_ids(course_sis_id)
+    pending = [
+        (student, grade) for student, grade in grades if student["id"] not in posted
+    ]
+    skipped = len(grades) - len(pending)
+
+    start = time.monotonic()
+    results = fan_out(
+        pending,
+        lambda student_and_grade: post_final_grade(
+            course_sis_id, lh_client, *student_and_grade
+        ),
+        max_workers=max_workers,
+        timeout=None,
+    )
+    elapsed = time.monotonic() - start
+
+    failures = [result for result in results if result.error]
+    succeeded = len(results) - len(failures)
+    print(
+        f"Posted {succeeded} grades in {elapsed:.2f}s "
+        f"({succeeded / max(elapsed, 1e-9):.1f}/s); {len(failures)} failed and "
+        f"{skipped} were already posted. Attempts are logged to {FINAL_GRADES_JOURNAL_PATH}."
+    )
+
+    return results
@@ -0,0 +1,204 @@
+"""
+Sends Canvas conversations to many students, personalized or not.
+
+Messages are rendered per recipient from a subject and body template.
+Recipients whose rendered message is identical share a single bulk request
+(sent asynchronously by Canvas once it is large enough, as a conversation
+batch that is polled until it finishes); personalized messages are sent concurrently, one request each.
+Every attempt is appended to a send log under the LUGACH directory.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, NamedTuple
+
+from canvasapi import Canvas
+from canvasapi.requester import Requester
+from canvasapi.user import User
+from canvasapi.util import combine_kwargs
+
+import lugach.core.constants as cs
+from lugach.core.fanout import FanOutResult, fan_out
+from lugach.core.secrets import ROOT_DIR
+
+SEND_LOG_PATH = ROOT_DIR / "message_log.jsonl"
+
+_send_log_lock = threading.Lock()
+
+
+class Message(NamedTuple):
+    recipient_ids: tuple[int, ...]
+    subject: str
+    body: str
+
+
+def render_messages(
+    recipients: list[User],
+    subject_template: str,
+    body_template: str,
+    fields_for: Callable[[User], dict[str, Any]],
+) -> list[Message]:
+    """
+    Fills in the templates for each recipient with `str.format`, using the
+    fields returned by `fields_for(recipient)`. Recipients whose rendered
+    subject and body match are merged into one message.
+    """
+    recipient_ids_by_content: dict[tuple[str, str], list[int]] = {}
+    for recipient in recipients:
+        fields = fields_for(recipient)
+        content = (subject_template.format(**fields), body_template.format(**fields))
+        recipient_ids_by_content.setdefault(content, []).append(recipient.id)
+
+    return [
+        Message(tuple(recipient_ids), subject, body)
+        for (subject, body), recipient_ids in recipient_ids_by_content.items()
+    ]
+
+
+def _log_send(
+    message: Message, context_code: str, status: str, error: Exception | None = None
+) -> None:
+    entry = {
+        "sent_at": datetime.now(timezone.utc).isoformat(),
+        "context_code": context_code,
+        "recipient_ids": list(message.recipient_ids),
+        "subject": message.subject,
+        "status": status,
+        "error": str(error) if error else None,
+    }
+    with _send_log_lock, open(SEND_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def _find_batch(requester: Requester, message: Message) -> dict | None:
+    """
+    Finds the running conversation batch that is sending `message`, or
+    returns None once it has finished (Canvas only lists running batches).
+    """
+    batches = requester.request("GET", "conversations/batches").json()
+    for batch in batches:
+        if (
+            batch.get("recipient_count") == len(message.recipient_ids)
+            and (batch.get("message") or {}).get("body") == message.body
+        ):
+            return batch
+
+    return None
+
+
+def _wait_for_batch(requester: Requester, message: Message) -> bool:
+    """
+    Polls the conversation batch sending `message` until Canvas finishes it,
+    for at most `cs.BATCH_POLL_TIMEOUT_SECS`. Returns whether it finished.
+    """
+    deadline = time.monotonic() + cs.BATCH_POLL_TIMEOUT_SECS
+    while (batch := _find_batch(requester, message)) is not None:
+        if batch.get("workflow_state") == "failed":
+            raise RuntimeError("Canvas failed to send the message.")
+        if time.monotonic() >= deadline:
+            print()
+            return False
+
+        print(
+            f"\r    Sending to {len(message.recipient_ids)} recipients... "
+            f"{(batch.get('completion') or 0) * 100:.0f}%",
+            end="",
+            flush=True,
+        )
+        time.sleep(cs.PROGRESS_POLL_SECS)
+    print()
+
+    return True
+
+
+def _send_message(canvas: Canvas, message: Message, context_code: str) -> str:
+    """
+    Sends `message` and returns its status: "sent", or "queued" if Canvas is
+    still sending it in the background.
+    """
+    requester = canvas._Canvas__requester
+    kwargs = {
+        "recipients": [str(recipient_id) for recipient_id in message.recipient_ids],
+        "subject": message.subject,
+        "body": message.body,
+        "context_code": context_code,
+    }
+    async_mode = len(message.recipient_ids) >= cs.ASYNC_BULK_MESSAGE_THRESHOLD
+    if len(message.recipient_ids) > 1:
+        # One private conversation per recipient, created by a single request.
+        kwargs.update(
+            group_conversation=True,
+            bulk_message=True,
+            mode="async" if async_mode else "sync",
+        )
+
+    try:
+        requester.request("POST", "conversations", _kwargs=combine_kwargs(**kwargs))
+    except Exception as e:
+        _log_send(message, context_code, "failed", e)
+        raise
+
+    if not (async_mode and len(message.recipient_ids) > 1):
+        _log_send(message, context_code, "sent")
+        return "sent"
+
+    # An async request returns an empty list; the send runs as a batch.
+    _log_send(message, context_code, "queued")
+    try:
+        finished = _wait_for_batch(requester, message)
+    except Exception as e:
+        _log_send(message, context_code, "failed", e)
+        raise
+
+    status = "sent" if finished else "queued"
+    if finished:
+        _log_send(message, context_code, status)
+
+    return status
+
+
+def send_messages(
+    canvas: Canvas, messages: list[Message], context_code: str
+) -> list[FanOutResult]:
+    """
+    Sends the messages concurrently (within the Canvas rate limit) and logs
+    each one to `SEND_LOG_PATH`.
+
+    Parameters
+    ----------
+    `canvas`: [Canvas](https://canvasapi.readthedocs.io/en/stable/canvas-ref.html)
+        Provides access to the Canvas API.
+
+    `messages`: list[Message]
+        The messages to send, e.g. from `render_messages`.
+
+    `context_code`: str
+        The context to send the messages in, e.g. `course_12345`.
+
+    Returns
+    -------
+    list[FanOutResult]
+        One result per message, with `value` "sent" or "queued" and `error`
+        set for any that failed.
+    """
+    results = fan_out(
+        messages,
+        lambda message: _send_message(canvas, message, context_code),
+        timeout=None,
+    )
+
+    recipients_by_status = {"sent": 0, "queued": 0, "failed": 0}
+    for r in results:
+        recipients_by_status["failed" if r.error else r.value] += len(
+            r.item.recipient_ids
+        )
+
+    print(
+        f"Sent to {recipients_by_status['sent']} recipients, "
+        f"{recipients_by_status['queued']} still queued by Canvas "
+        f"({recipients_by_status['failed']} failed). Logged to {SEND_LOG_PATH}."
+    )
+
+    return results
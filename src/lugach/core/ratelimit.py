@@ -0,0 +1,197 @@
+"""
+Keeps Canvas requests under the API's rate limit without being needlessly
+slow.
+
+Canvas charges each request a cost against a per-token bucket and reports
+the result in the `X-Request-Cost` and `X-Rate-Limit-Remaining` headers,
+answering "403 Forbidden (Rate Limit Exceeded)" once the bucket is empty.
+`CanvasRateLimiter` sits under canvasapi's requester and:
+
+- Keeps a token bucket fed by those headers, in a ledger file shared (under a
+  file lock) by every thread and every `lugach` process using the same token.
+- Waits for the bucket to refill when it runs low instead of getting throttled.
+- Raises or lowers how many requests it lets run at once based on how much of
+  the bucket is left, and retries requests that were throttled anyway.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from canvasapi import Canvas
+
+import lugach.core.constants as cs
+from lugach.core.secrets import ROOT_DIR
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LEDGER_DIR = ROOT_DIR / "ratelimit"
+
+_THROTTLED_MESSAGE = "Rate Limit Exceeded"
+_COST_SMOOTHING = 0.2
+
+
+@contextmanager
+def _file_lock(path) -> Iterator[None]:
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CanvasRateLimiter:
+    """
+    A token bucket and concurrency limit for one Canvas access token.
+
+    Parameters
+    ----------
+    `access_token`: str
+        The token whose budget to track. Only a hash of it is written to disk.
+
+    `max_concurrency`: int
+        The most requests this process may have in flight at once.
+    """
+
+    def __init__(self, access_token: str, max_concurrency=cs.MAX_WORKERS):
+        LEDGER_DIR.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+        self.ledger_path = LEDGER_DIR / f"{digest}.json"
+        self.lock_path = LEDGER_DIR / f"{digest}.lock"
+
+        self.max_concurrency = max_concurrency
+        self.concurrency = max(1, max_concurrency // 2)
+        self.in_flight = 0
+        self.request_cost = cs.CANVAS_INITIAL_REQUEST_COST
+        self._condition = threading.Condition()
+
+    def _read_remaining(self) -> float:
+        """
+        Estimates what is left in the bucket now, counting what has leaked
+        back in since the ledger was last written. Call with the lock held.
+        """
+        try:
+            ledger = json.loads(self.ledger_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return cs.CANVAS_RATE_LIMIT_CAPACITY
+
+        refilled = (
+            time.time() - ledger["updated_at"]
+        ) * cs.CANVAS_RATE_LIMIT_REFILL_PER_SEC
+        return min(cs.CANVAS_RATE_LIMIT_CAPACITY, ledger["remaining"] + refilled)
+
+    def _write_remaining(self, remaining: float) -> None:
+        ledger = {"remaining": remaining, "updated_at": time.time()}
+        self.ledger_path.write_text(json.dumps(ledger))
+
+    def _reserve(self) -> float:
+        """
+        Deducts the expected cost of a request from the shared bucket.
+        Returns 0 if it was deducted, or the seconds to wait before trying
+        again if the bucket is too low.
+        """
+        with _file_lock(self.lock_path):
+            remaining = self._read_remaining()
+            needed = cs.CANVAS_RATE_LIMIT_LOW_WATER + self.request_cost
+            if remaining < needed:
+                return (needed - remaining) / cs.CANVAS_RATE_LIMIT_REFILL_PER_SEC
+
+            self._write_remaining(remaining - self.request_cost)
+            return 0
+
+    def _record(self, headers) -> None:
+        remaining = headers.get("X-Rate-Limit-Remaining")
+        cost = headers.get("X-Request-Cost")
+
+        with self._condition:
+            if cost is not None:
+                self.request_cost += _COST_SMOOTHING * (float(cost) - self.request_cost)
+
+            if remaining is None:
+                return
+
+            remaining = float(remaining)
+            if remaining > cs.CANVAS_RATE_LIMIT_CAPACITY / 2:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            elif remaining < cs.CANVAS_RATE_LIMIT_CAPACITY / 4:
+                self.concurrency = max(1, self.concurrency - 1)
+            self._condition.notify_all()
+
+        with _file_lock(self.lock_path):
+            self._write_remaining(remaining)
+
+    def _throttled(self) -> None:
+        with self._condition:
+            self.concurrency = max(1, self.concurrency // 2)
+
+        with _file_lock(self.lock_path):
+            self._write_remaining(0)
+
+    @contextmanager
+    def _slot(self) -> Iterator[None]:
+        with self._condition:
+            while self.in_flight >= self.concurrency:
+                self._condition.wait()
+            self.in_flight += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def wrap(self, send):
+        """
+        Wraps a `requests.Session.request`-style callable so that every call
+        goes through the limiter.
+        """
+
+        def scheduled_send(*args, **kwargs):
+            for _ in range(cs.RELOAD_ATTEMPTS):
+                while (wait_secs := self._reserve()) > 0:
+                    time.sleep(wait_secs)
+
+                with self._slot():
+                    response = send(*args, **kwargs)
+
+                if response.status_code == 403 and _THROTTLED_MESSAGE in response.text:
+                    self._throttled()
+                    continue
+
+                self._record(response.headers)
+                return response
+
+            return response
+
+        return scheduled_send
+
+
+def install_rate_limiter(canvas: Canvas) -> CanvasRateLimiter:
+    """
+    Routes every request that `canvas` (and every object created from it)
+    sends through a `CanvasRateLimiter` for its access token.
+    """
+    requester = canvas._Canvas__requester
+    limiter = CanvasRateLimiter(requester.access_token)
+    session = requester._session
+    session.request = limiter.wrap(session.request)
+
+    return limiter
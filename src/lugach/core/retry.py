@@ -0,0 +1,236 @@
+"""
+One retry policy for every backend `lugach` talks to (Canvas, Top Hat and
+Lighthouse), installed under each backend's `requests.Session`.
+
+Every request sent through a session with `install_retries`:
+
+- Gets the backend's (connect, read) timeout unless the caller passes one.
+- Is retried on connection errors, timeouts, 429s and 5xx responses, waiting
+  for an exponential backoff scaled by a random factor so that concurrent
+  retries spread out, or for as long as the server's `Retry-After` asks.
+- Is only retried after it may have reached the server if it is idempotent.
+  GET, PUT, DELETE and friends are; a POST is only if the caller passes
+  `idempotent=True`. Other POSTs are retried only when the server cannot
+  have acted on them: a connect timeout, a 429, or a 503.
+- Fails fast with `CircuitOpenError` while the host's circuit breaker is
+  open, which happens after `cs.CIRCUIT_FAILURE_THRESHOLD` failures in a
+  row. After `cs.CIRCUIT_RESET_SECS`, one request is let through to probe
+  the host, and the breaker closes again once a request succeeds.
+
+Responses with error statuses are returned once the retries run out, not
+raised, so each client keeps its own error handling.
+"""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, NamedTuple
+from urllib.parse import urlparse
+
+import requests
+
+import lugach.core.constants as cs
+
+type Timeout = tuple[float, float]
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+
+_breakers: dict[str, "CircuitBreaker"] = {}
+_breakers_lock = threading.Lock()
+
+
+class RetryPolicy(NamedTuple):
+    attempts: int
+    timeout: Timeout
+    backoff_secs: float = cs.RETRY_BACKOFF_SECS
+    max_backoff_secs: float = cs.RETRY_MAX_BACKOFF_SECS
+
+
+CANVAS_POLICY = RetryPolicy(cs.CANVAS_RETRY_ATTEMPTS, cs.CANVAS_TIMEOUT_SECS)
+TH_POLICY = RetryPolicy(cs.TH_RETRY_ATTEMPTS, cs.TH_TIMEOUT_SECS)
+LH_POLICY = RetryPolicy(cs.LH_RETRY_ATTEMPTS, cs.LH_TIMEOUT_SECS)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host that keeps failing."""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures against one host.
+
+    Parameters
+    ----------
+    `host`: str
+        The host the breaker guards, used in error messages.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """
+        Raises `CircuitOpenError` if the breaker is open, unless it is time
+        to let a single request through to probe the host.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            waited = time.monotonic() - self.opened_at
+            if waited < cs.CIRCUIT_RESET_SECS or self._probing:
+                raise CircuitOpenError(
+                    f"{self.host} failed {self.failures} times in a row; "
+                    f"not sending requests to it for {cs.CIRCUIT_RESET_SECS}s."
+                )
+
+            self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= cs.CIRCUIT_FAILURE_THRESHOLD:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+
+        return _breakers[host]
+
+
+def backoff_secs(policy: RetryPolicy, attempt: int) -> float:
+    """
+    The delay before retrying after the given attempt: exponential, capped,
+    and scaled by a random factor between 0.5 and 1.5.
+    """
+    delay = min(policy.backoff_secs * 2 ** (attempt - 1), policy.max_backoff_secs)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def retry_after_secs(response: requests.Response) -> float | None:
+    """
+    Reads the `Retry-After` header, which is either a number of seconds or
+    an HTTP date, or returns None if there is none.
+    """
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _is_host_failure(status_code: int) -> bool:
+    return status_code >= 500
+
+
+def _is_retryable_status(status_code: int, idempotent: bool) -> bool:
+    if status_code in (429, 503):
+        return True
+
+    return idempotent and _is_host_failure(status_code)
+
+
+def _is_retryable_error(error: requests.RequestException, idempotent: bool) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    return idempotent and isinstance(
+        error, (requests.ConnectionError, requests.Timeout)
+    )
+
+
+def send_with_retries(
+    send: Callable[..., requests.Response],
+    method: str,
+    url: str,
+    policy: RetryPolicy,
+    idempotent: bool | None = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Sends a request with `send` (e.g. `requests.Session.request`) under
+    `policy`, as described at the top of this module.
+
+    Parameters
+    ----------
+    `idempotent`: bool | None
+        Whether the request can safely be sent twice. Defaults to whether
+        `method` is idempotent.
+    """
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    kwargs.setdefault("timeout", policy.timeout)
+    breaker = breaker_for(url)
+
+    for attempt in range(1, policy.attempts + 1):
+        breaker.check()
+        try:
+            response = send(method, url, **kwargs)
+        except requests.RequestException as e:
+            if not isinstance(e, CircuitOpenError):
+                breaker.record_failure()
+            if attempt == policy.attempts or not _is_retryable_error(e, idempotent):
+                raise
+
+            time.sleep(backoff_secs(policy, attempt))
+            continue
+
+        if _is_host_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if attempt == policy.attempts or not _is_retryable_status(
+            response.status_code, idempotent
+        ):
+            return response
+
+        delay = retry_after_secs(response)
+        if delay is None:
+            delay = backoff_secs(policy, attempt)
+        elif delay > policy.max_backoff_secs:
+            return response
+
+        time.sleep(delay)
+
+
+def install_retries(session: requests.Session, policy: RetryPolicy) -> None:
+    """
+    Routes every request that `session` sends through `send_with_retries`.
+    The session's `request` then also accepts an `idempotent` keyword.
+    """
+    send = session.request
+
+    def request_with_retries(method, url, idempotent=None, **kwargs):
+        return send_with_retries(send, method, url, policy, idempotent, **kwargs)
+
+    session.request = request_with_retries
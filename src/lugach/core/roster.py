@@ -0,0 +1,194 @@
+"""
+An in-memory index over a course roster for offline name lookup.
+
+The index is built once per roster. Every name is normalized up front
+(casefolded, accents stripped, whitespace collapsed) and broken into short
+substrings and padded trigrams, so answering a query never touches the
+network and never re-normalizes the roster.
+"""
+
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Iterable
+
+_MIN_FUZZY_SIMILARITY = 0.3
+_MAX_SUGGESTIONS = 5
+
+
+def normalize_name(name: str) -> str:
+    """
+    Returns a casefolded, accent-stripped version of a name with runs of
+    whitespace collapsed to a single space, e.g. "  José  Núñez" becomes
+    "jose nunez".
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+def _substrings(text: str, length: int) -> set[str]:
+    return {text[i : i + length] for i in range(len(text) - length + 1)}
+
+
+def _padded_trigrams(key: str) -> set[str]:
+    return _substrings(f" {key} ", 3)
+
+
+class RosterIndex[T]:
+    """
+    Ranks roster entries against a name query.
+
+    Substring matches are ordered as exact match, then match at the start
+    of the name, then match at the start of any word, then anywhere, and
+    alphabetically within each group.
+    Suggestions by trigram similarity, which tolerate typos, are kept
+    separate, since they may well name a different student.
+
+    Parameters
+    ----------
+    `entries`: Iterable
+        The students to index (Canvas `User` objects, Top Hat student
+        dicts, etc.).
+
+    `name_of`: Callable
+        Returns the display name of an entry.
+    """
+
+    def __init__(self, entries: Iterable[T], name_of: Callable[[T], str]):
+        # Entries are stored in name order, so sorting positions sorts names.
+        keyed_entries = sorted(
+            ((normalize_name(name_of(entry)), entry) for entry in entries),
+            key=lambda keyed_entry: keyed_entry[0],
+        )
+        self.keys = [key for key, _ in keyed_entries]
+        self.entries = [entry for _, entry in keyed_entries]
+        self.names = [name_of(entry) for entry in self.entries]
+
+        # Every 1- and 2-character substring, so short queries are one lookup.
+        self._short_index: dict[str, set[int]] = defaultdict(set)
+        self._trigram_index: dict[str, set[int]] = defaultdict(set)
+        self._trigram_counts: list[int] = []
+        for i, key in enumerate(self.keys):
+            for substring in _substrings(key, 1) | _substrings(key, 2):
+                self._short_index[substring].add(i)
+
+            trigrams = _padded_trigrams(key)
+            for trigram in trigrams:
+                self._trigram_index[trigram].add(i)
+            self._trigram_counts.append(len(trigrams))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _rank(self, matches: set[int], query: str) -> list[int]:
+        word_start = f" {query}"
+        exact, name_start, other_word_start, anywhere = [], [], [], []
+        for i in sorted(matches):
+            key = self.keys[i]
+            if key.startswith(query):
+                (exact if key == query else name_start).append(i)
+            elif word_start in key:
+                other_word_start.append(i)
+            else:
+                anywhere.append(i)
+
+        return exact + name_start + other_word_start + anywhere
+
+    def _substring_matches(self, query: str) -> set[int]:
+        if len(query) < 3:
+            return set(self._short_index.get(query, ()))
+
+        postings = sorted(
+            (
+                self._trigram_index.get(trigram, set())
+                for trigram in _substrings(query, 3)
+            ),
+            key=len,
+        )
+        # The rarest few trigrams narrow the candidates enough to verify directly.
+        candidates = postings[0].intersection(*postings[1:3])
+        if len(query) == 3:
+            return candidates
+
+        return {i for i in candidates if query in self.keys[i]}
+
+    def _fuzzy_matches(self, query: str) -> list[int]:
+        query_trigrams = _padded_trigrams(query)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for i in self._trigram_index.get(trigram, ()):
+                shared[i] += 1
+
+        scored = []
+        for i, count in shared.items():
+            similarity = 2 * count / (len(query_trigrams) + self._trigram_counts[i])
+            if similarity >= _MIN_FUZZY_SIMILARITY:
+                scored.append((-similarity, i))
+
+        return [i for _, i in sorted(scored)]
+
+    def search_indices(self, query: str, within: set[int] | None = None) -> list[int]:
+        """
+        Returns the positions of the entries whose names contain `query`,
+        best match first. If `within` is given, only those positions are
+        considered.
+        """
+        query = normalize_name(query)
+        if not query:
+            return list(range(len(self.entries))) if within is None else sorted(within)
+
+        matches = self._substring_matches(query)
+        if within is not None:
+            matches &= within
+
+        return self._rank(matches, query)
+
+    def suggest_indices(self, query: str, within: set[int] | None = None) -> list[int]:
+        """
+        Returns the positions of the entries whose names are similar to
+        `query` without containing it, most similar first.
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+
+        return [i for i in self._fuzzy_matches(query) if within is None or i in within]
+
+    def search(self, query: str) -> list[T]:
+        return [self.entries[i] for i in self.search_indices(query)]
+
+    def suggest(self, query: str) -> list[T]:
+        return [self.entries[i] for i in self.suggest_indices(query)]
+
+
+def choose_suggestion[T](
+    roster_index: RosterIndex[T], query: str, within: set[int] | None = None
+) -> T | None:
+    """
+    Offers the names similar to `query` and returns the entry the user
+    picks, or None if there are none or the user picks none of them. A
+    suggestion is never chosen without asking, since it may be a different
+    student with a similar name.
+    """
+    suggestions = roster_index.suggest_indices(query, within)[:_MAX_SUGGESTIONS]
+    if not suggestions:
+        return None
+
+    print(f"\nNo student's name contains '{query}'. Did you mean:\n")
+    for number, i in enumerate(suggestions, start=1):
+        print(f"    {number}. {roster_index.names[i]}")
+    print()
+
+    while True:
+        choice = input("Enter the number of the student (blank to search again): ")
+        if not choice.strip():
+            return None
+
+        try:
+            number = int(choice)
+            if 1 <= number <= len(suggestions):
+                return roster_index.entries[suggestions[number - 1]]
+        except ValueError:
+            pass
+
+        print(f"Please enter a number from 1 to {len(suggestions)}.")
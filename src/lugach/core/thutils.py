@@ -1,20 +1,43 @@
-from typing import Any, Optional
-
+import base64
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Any, Iterator, NamedTuple, Optional
+from urllib.parse import urljoin
+
+import lugach.core.constants as cs
 import lugach.core.cvutils as cvu
 import requests
+from array import array
 from enum import Enum
-from datetime import datetime
+from datetime import date, datetime
+from requests.adapters import HTTPAdapter
 
-from lugach.core.secrets import get_secret
+from lugach.core.fanout import FanOutResult, fan_out
+from lugach.core.retry import TH_POLICY, install_retries, send_with_retries
+from lugach.core.roster import RosterIndex, choose_suggestion
+from lugach.core.secrets import get_secret, update_env_file
 
 type Course = dict[str, Any]
 type Student = dict[str, Any]
 type AuthHeader = dict[str, str]
 type AttendanceItem = dict[str, Any]
 type AttendanceProportion = tuple[int, int]
+type Timeout = tuple[float, float]
 
 
 AUTH_KEY_SECRET_NAME = "TH_AUTH_KEY"
+JWT_SECRET_NAME = "TH_JWT"
+JWT_EXP_SECRET_NAME = "TH_JWT_EXP"
+JWT_KEY_FINGERPRINT_SECRET_NAME = "TH_JWT_KEY_FINGERPRINT"
+TH_BASE_URL = "https://app.tophat.com"
+
+_NOT_RECORDED = 0xFF
 
 
 class AttendanceOptions(Enum):
@@ -28,36 +51,369 @@ def _get_th_auth_token_from_env_file() -> str:
     return TH_AUTH_KEY
 
 
-def get_auth_header_for_session() -> AuthHeader:
-    jwt_url = "https://app.tophat.com/identity/v1/refresh_jwt/"
+def _decode_jwt_exp(jwt_token: str) -> int:
+    """
+    Reads the expiry (in seconds since the epoch) from the JWT's payload
+    without verifying it, or returns 0 if it has none.
+    """
+    try:
+        payload = jwt_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return int(claims.get("exp", 0))
+    except (IndexError, ValueError, TypeError):
+        return 0
+
+
+def _fingerprint_auth_key(auth_key: str) -> str:
+    return hashlib.sha256(auth_key.encode("utf-8")).hexdigest()
+
+
+def _get_cached_jwt(auth_key: str) -> str | None:
+    """
+    Returns the JWT saved by the last refresh if it was obtained with
+    `auth_key` and is not within `cs.TH_JWT_REFRESH_MARGIN_SECS` of expiring.
+    """
+    try:
+        jwt_token = get_secret(JWT_SECRET_NAME)
+        exp = int(get_secret(JWT_EXP_SECRET_NAME))
+        fingerprint = get_secret(JWT_KEY_FINGERPRINT_SECRET_NAME)
+    except (NameError, ValueError):
+        return None
+
+    if fingerprint != _fingerprint_auth_key(auth_key):
+        return None
+
+    if exp - cs.TH_JWT_REFRESH_MARGIN_SECS <= time.time():
+        return None
+
+    return jwt_token
+
+
+def _cache_jwt(jwt_token: str, auth_key: str) -> None:
+    update_env_file(
+        **{
+            JWT_SECRET_NAME: jwt_token,
+            JWT_EXP_SECRET_NAME: str(_decode_jwt_exp(jwt_token)),
+            JWT_KEY_FINGERPRINT_SECRET_NAME: _fingerprint_auth_key(auth_key),
+        }
+    )
+
+
+class TopHatClient:
+    """
+    Sends every Top Hat request for a session over one pooled, keep-alive
+    `requests.Session`, so that only the first request to app.tophat.com
+    pays for the TCP and TLS handshakes.
+
+    Each request has a (connect, read) timeout, which can be raised for
+    endpoints known to be slow, and is retried under `retry.TH_POLICY`.
+    Headers that only apply to some requests,
+    such as `Course-Id`, are passed per request instead of being stored.
+
+    If the JWT expires partway through a long run, the first request to be
+    rejected with a 401 refreshes it and is then retried once.
+    """
+
+    def __init__(self, base_url=TH_BASE_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cs.MAX_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        install_retries(self.session, TH_POLICY)
+        self.session.headers.update(
+            {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+        )
+        self._auth_lock = threading.Lock()
+
+    def authenticate(self, force_refresh=False) -> None:
+        self.session.headers.update(
+            get_auth_header_for_session(self, force_refresh=force_refresh)
+        )
+
+    def _reauthenticate(self, rejected_authorization: str) -> None:
+        with self._auth_lock:
+            # Another thread may have refreshed the JWT while this one waited.
+            if self.session.headers.get("Authorization") == rejected_authorization:
+                self.authenticate(force_refresh=True)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        course_id: Optional[int] = None,
+        timeout: Timeout = cs.TH_TIMEOUT_SECS,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Sends a request to `path` (relative to `base_url`, or an absolute
+        URL such as a `next` link) and raises for any error status.
+
+        Parameters
+        ----------
+        `course_id`: Optional[int]
+            Sent as the `Course-Id` header, which some endpoints require.
+
+        `timeout`: tuple[float, float]
+            The seconds to wait to connect and to wait for a response.
+
+        `idempotent`: Optional[bool]
+            Whether the request may be retried after it could have reached
+            Top Hat. Defaults to whether `method` is idempotent.
+        """
+        headers = kwargs.pop("headers", {})
+        if course_id is not None:
+            headers["Course-Id"] = str(course_id)
+
+        url = urljoin(self.base_url, path)
+        authorization = self.session.headers.get("Authorization")
+        response = self.session.request(
+            method,
+            url,
+            headers=headers,
+            timeout=timeout,
+            idempotent=idempotent,
+            **kwargs,
+        )
+        if response.status_code == 401 and authorization:
+            self._reauthenticate(authorization)
+            response = self.session.request(
+                method, url, headers=headers, timeout=timeout, **kwargs
+            )
+        response.raise_for_status()
+
+        return response
+
+    def get(self, path: str, **kwargs) -> Any:
+        return self.request("GET", path, **kwargs).json()
+
+    def post(self, path: str, **kwargs) -> Any:
+        return self.request("POST", path, **kwargs).json()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def get_auth_header_for_session(
+    client: Optional[TopHatClient] = None, force_refresh=False
+) -> AuthHeader:
+    """
+    Returns the `Authorization` header for Top Hat, reusing the saved JWT
+    until shortly before it expires (or `force_refresh` is set, or the auth
+    key has changed since) and otherwise exchanging the auth key for a new
+    one.
+    """
+    auth_key = _get_th_auth_token_from_env_file()
+    jwt_token = None if force_refresh else _get_cached_jwt(auth_key)
+    if jwt_token:
+        return {"Authorization": f"Bearer {jwt_token}"}
+
+    if client:
+        send = client.session.request
+    else:
+        send = partial(send_with_retries, requests.request, policy=TH_POLICY)
+    base_url = client.base_url if client else TH_BASE_URL
+
+    jwt_url = urljoin(base_url, "/identity/v1/refresh_jwt/")
     jwt_data = {
-        "th_jwt_refresh": _get_th_auth_token_from_env_file(),
+        "th_jwt_refresh": auth_key,
     }
 
-    jwt_response = requests.post(jwt_url, json=jwt_data)
+    # Exchanging the same auth key twice just yields two valid JWTs.
+    jwt_response = send("POST", jwt_url, idempotent=True, json=jwt_data)
 
     if jwt_response.status_code != 201:
         raise ConnectionRefusedError("Unable to obtain JWT token")
 
     jwt_token = jwt_response.json()["th_jwt"]
+    _cache_jwt(jwt_token, auth_key)
 
     auth_header = {"Authorization": f"Bearer {jwt_token}"}
     return auth_header
 
 
-def get_th_courses(auth_header: AuthHeader) -> list[Course]:
-    courses_url = "https://app.tophat.com/api/v2/courses/"
-
-    response = requests.get(courses_url, headers=auth_header)
-    payload = response.json()
+def create_th_client(force_refresh=False) -> TopHatClient:
+    client = TopHatClient()
+    client.authenticate(force_refresh=force_refresh)
 
-    courses = payload["objects"]
+    return client
 
-    return courses
 
+class TopHatPaginatedList:
+    """
+    A lazy list of the objects returned by a Top Hat endpoint, in the spirit
+    of canvasapi's `PaginatedList`.
+
+    Pages are followed through their `next` links, with each page fetched
+    while the previous one is being consumed; pages are not kept once
+    consumed. Slicing returns another lazy list that starts at the right
+    offset, and `len()` uses the count the endpoint reports where it can
+    instead of downloading everything.
+
+    Only endpoints known to page their results (`paged=True`) are sent
+    `limit` and `offset`. Any other endpoint, such as one that returns a
+    bare JSON list, is requested once as is and sliced locally.
+    """
 
-def prompt_user_for_th_course(auth_header: AuthHeader) -> Course:
-    raw_courses = get_th_courses(auth_header)
+    def __init__(
+        self,
+        client: TopHatClient,
+        path: str,
+        params: Optional[dict] = None,
+        root: Optional[str] = None,
+        paged: bool = False,
+        limit: int = cs.TH_PAGE_SIZE,
+        offset: int = 0,
+        stop: Optional[int] = None,
+        timeout: Timeout = cs.TH_TIMEOUT_SECS,
+    ):
+        self._client = client
+        self._path = path
+        self._params = params or {}
+        self._root = root
+        self._paged = paged
+        self._limit = limit
+        self._offset = offset
+        self._stop = stop
+        self._timeout = timeout
+        self._first_page = None
+
+    def __repr__(self) -> str:
+        return f"<TopHatPaginatedList of {self._path}>"
+
+    def _get(self, url: str, params: Optional[dict] = None) -> Any:
+        return self._client.get(url, params=params, timeout=self._timeout)
+
+    def _get_first_page(self) -> Any:
+        if self._first_page is None:
+            params = dict(self._params)
+            if self._paged:
+                params["limit"] = self._limit
+                if self._stop is not None:
+                    params["limit"] = min(self._limit, self._stop)
+                if self._offset:
+                    params["offset"] = self._offset
+
+            self._first_page = self._get(self._path, params)
+
+        return self._first_page
+
+    def _split_page(self, page: Any) -> tuple[list, Optional[str], Optional[int]]:
+        """
+        Returns the page's objects, the URL of the next page, and the total
+        number of objects if the endpoint reports it.
+        """
+        if isinstance(page, list):
+            return page, None, len(page)
+
+        if self._root:
+            objects = page[self._root]
+        else:
+            objects = page.get("results", page.get("objects", []))
+
+        meta = page.get("meta") or {}
+        next_url = page.get("next", meta.get("next"))
+        count = page.get("count", meta.get("total_count"))
+
+        return objects, next_url, count
+
+    def _split_first_page(self) -> tuple[list, Optional[str], Optional[int]]:
+        page = self._get_first_page()
+        objects, next_url, count = self._split_page(page)
+
+        if not self._paged:
+            # `offset` was not sent, so skip ahead here instead.
+            objects = objects[self._offset :]
+        if isinstance(page, list):
+            count = len(objects)
+        elif count is not None:
+            count = max(0, count - self._offset)
+
+        return objects, next_url, count
+
+    def __iter__(self) -> Iterator:
+        if self._stop == 0:
+            return
+
+        objects, next_url, _ = self._split_first_page()
+        remaining = self._stop
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                needs_next_page = remaining is None or remaining > len(objects)
+                next_page = (
+                    executor.submit(self._get, next_url)
+                    if next_url and needs_next_page
+                    else None
+                )
+
+                if remaining is not None:
+                    objects = objects[:remaining]
+                    remaining -= len(objects)
+                yield from objects
+
+                if not next_page:
+                    return
+                objects, next_url, _ = self._split_page(next_page.result())
+
+    def __len__(self) -> int:
+        if self._stop == 0:
+            return 0
+
+        objects, next_url, count = self._split_first_page()
+        if count is None and not next_url:
+            count = len(objects)
+        if count is None:
+            # Nothing reports the total, so count while streaming the pages.
+            count = sum(1 for _ in self)
+
+        return count if self._stop is None else min(count, self._stop)
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.start or 0, index.stop, index.step
+            if start < 0 or (stop is not None and stop < 0):
+                start, stop, _ = index.indices(len(self))
+
+            length = None if stop is None else max(0, stop - start)
+            if self._stop is not None:
+                remaining = max(0, self._stop - start)
+                length = remaining if length is None else min(length, remaining)
+
+            sliced = TopHatPaginatedList(
+                self._client,
+                self._path,
+                params=self._params,
+                root=self._root,
+                paged=self._paged,
+                limit=self._limit,
+                offset=self._offset + start,
+                stop=length,
+                timeout=self._timeout,
+            )
+            if not self._paged:
+                # The slice comes from the same response.
+                sliced._first_page = self._first_page
+            return sliced if step in (None, 1) else list(islice(sliced, 0, None, step))
+
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for obj in self[index : index + 1]:
+                return obj
+
+        raise IndexError("TopHatPaginatedList index out of range")
+
+
+def get_th_courses(client: TopHatClient) -> TopHatPaginatedList:
+    return TopHatPaginatedList(client, "/api/v2/courses/", root="objects")
+
+
+def prompt_user_for_th_course(client: TopHatClient) -> Course:
+    raw_courses = get_th_courses(client)
     courses_dict = {}
 
     for course in raw_courses:
@@ -91,99 +447,97 @@ def prompt_user_for_th_course(auth_header: AuthHeader) -> Course:
 
 
 def get_th_students(
-    auth_header: AuthHeader,
+    client: TopHatClient,
     course: Optional[Course] = None,
     course_id: Optional[int] = None,
-) -> list[Student]:
+) -> TopHatPaginatedList:
     if not course_id:
         if not course:
             raise TypeError("No course or course_id given.")
 
         course_id = course["course_id"]
 
-    students_url = f"https://app.tophat.com/api/v3/course/{course_id}/students/"
-
-    response = requests.get(url=students_url, headers=auth_header)
+    return TopHatPaginatedList(client, f"/api/v3/course/{course_id}/students/")
 
-    students = response.json()
-    return students
 
-
-def prompt_user_for_th_student(course: Course, auth_header: AuthHeader) -> Student:
-    all_students = get_th_students(auth_header, course)
-    student_results = all_students
-    student = None
+def prompt_user_for_th_student(course: Course, client: TopHatClient) -> Student:
+    all_students = get_th_students(client, course)
+    roster_index = RosterIndex(all_students, name_of=lambda student: student["name"])
+    matches = None
 
     while True:
         query = input("Search for the student by name: ")
-        student_results = [
-            student
-            for student in student_results
-            if cvu.sanitize_string(query) in cvu.sanitize_string(student["name"])
-        ]
+        within = matches
+        matches = roster_index.search_indices(query, within=within)
 
-        students_len = len(student_results)
+        students_len = len(matches)
 
         if students_len == 0:
+            suggestion = choose_suggestion(roster_index, query, within=within)
+            if suggestion is not None:
+                print(f"\nYou chose {suggestion['name']}.")
+                return suggestion
+
             print("\nNo such student was found.")
-            student_results = all_students
+            matches = None
             continue
         elif students_len == 1:
-            student = student_results[0]
+            student = roster_index.entries[matches[0]]
             print(f"You chose {student['name']}.")
             return student
 
         print(f"\nYour query returned {students_len} students.")
         print("Here are their names:\n")
-        for student in student_results:
-            print(f"    {student['name']}")
+        for i in matches:
+            print(f"    {roster_index.entries[i]['name']}")
         print()
+        matches = set(matches)
 
 
-def get_attendance_item(auth_header: AuthHeader, attendance_id: int) -> AttendanceItem:
-    attendance_item_url = f"https://app.tophat.com/api/v2/attendance/{attendance_id}"
-
-    attendance_item_response = requests.get(attendance_item_url, headers=auth_header)
-    attendance_item_response.raise_for_status()
-
-    return attendance_item_response.json()
+def get_attendance_item(client: TopHatClient, attendance_id: int) -> AttendanceItem:
+    return client.get(f"/api/v2/attendance/{attendance_id}")
 
 
 def get_all_th_attendance_proportions_for_course(
-    course: Course, auth_header: AuthHeader
+    course: Course, client: TopHatClient
 ) -> dict[int, AttendanceProportion]:
-    course_id = course["course_id"]
-    gradeable_items_url = f"https://app.tophat.com/api/gradebook/v1/gradeable_items/{course_id}/?limit=2000"
+    return get_attendance_matrix(course, client).proportions()
 
-    attendance_proportions = {}
-    while True:
-        response = requests.get(url=gradeable_items_url, headers=auth_header)
-        gradeable_items = response.json()
-
-        for result in gradeable_items["results"]:
-            if "attendance" not in result["item_id"]:
-                continue
 
-            student_id = result["student_id"]
-            attended = result["weighted_correctness"]
-            total = result["correctness_weight"]
+def get_th_absence_counts(
+    client: TopHatClient, course: Course
+) -> list[tuple[Student, int]]:
+    """
+    Returns every student in the course with their number of unexcused
+    absences. The roster is fetched while the attendance matrix is built,
+    and gradebook rows are matched to students by id.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        students = executor.submit(lambda: list(get_th_students(client, course)))
+        attendance_proportions = get_all_th_attendance_proportions_for_course(
+            course, client
+        )
+        students_by_id = {student["id"]: student for student in students.result()}
 
-            attendance_proportions[student_id] = (attended, total)
+    absence_counts = []
+    for student_id, (attended, total) in attendance_proportions.items():
+        student = students_by_id.get(student_id)
+        if not student:
+            print(f"Could not find student with id {student_id}", file=sys.stderr)
+            continue
 
-        if not gradeable_items["next"]:
-            break
-        gradeable_items_url = gradeable_items["next"]
+        absence_counts.append((student, total - attended))
 
-    return attendance_proportions
+    return absence_counts
 
 
 def get_th_attendance_proportion_for_student(
-    course: Course, student: Student, auth_header: AuthHeader
+    course: Course, student: Student, client: TopHatClient
 ) -> AttendanceProportion:
     course_id = course["course_id"]
-    metadata_url = f"https://app.tophat.com/api/gradebook/v1/gradeable_items/{course_id}/student/{student['id']}/metadata/"
-    response = requests.get(url=metadata_url, headers=auth_header)
-    metadata = response.json()
+    metadata = client.get(
+        f"/api/gradebook/v1/gradeable_items/{course_id}/student/{student['id']}/metadata/"
+    )
 
     attended = metadata["attended_count"]
     total = metadata["attendance_count"]
@@ -192,12 +546,12 @@ def get_th_attendance_proportion_for_student(
 
 
 def _get_th_attendance_item_names_and_ids(
-    course: Course, auth_header: AuthHeader
+    course: Course, client: TopHatClient
 ) -> list[tuple[str, int]]:
     course_id = course["course_id"]
-    course_item_url = f"https://app.tophat.com/api/v3/course/{course_id}/gradeable_course_items_aggregated/"
-    response = requests.get(url=course_item_url, headers=auth_header)
-    course_items = response.json()
+    course_items = TopHatPaginatedList(
+        client, f"/api/v3/course/{course_id}/gradeable_course_items_aggregated/"
+    )
 
     attendance_item_names_and_ids = [
         (course_item["name"], course_item["id"])
@@ -207,83 +561,223 @@ def _get_th_attendance_item_names_and_ids(
     return attendance_item_names_and_ids
 
 
-def _get_attendance_gradebook_data(
-    course: Course, student: Student, auth_header: AuthHeader
-) -> list[dict]:
+def _attended(option: AttendanceOptions) -> int:
+    return 1 if option == AttendanceOptions.PRESENT else 0
+
+
+def _counted(option: AttendanceOptions) -> int:
+    return 0 if option == AttendanceOptions.EXCUSED else 1
+
+
+class AttendanceMatrix:
     """
-    This data provides information necessary to determine whether a given absence was excused or not.
+    Every student's attendance for every attendance session in a course.
+
+    States are stored one byte per (student, session) in a single
+    `bytearray`, with running per-student counts of each option, so looking
+    up a record, a student's records, or a student's attendance proportion
+    never searches the gradebook rows. Students are added as they first
+    appear in the gradebook feed.
+
+    Each student's attendance aggregate row from the feed, which is what
+    Top Hat itself reports, is kept too and updated as records are edited.
     """
-    course_id = course["course_id"]
-    response = requests.get(
-        f"https://app.tophat.com/api/gradebook/v1/gradeable_items/{course_id}/?limit=2000&student_ids={student['id']}",
-        headers=auth_header,
-    )
-    attendance_gradebook_data = response.json()
 
-    return attendance_gradebook_data["results"]
+    def __init__(self, sessions: list[tuple[int, date]]):
+        self.sessions = sessions
+        self.student_ids: list[int] = []
+        self._columns = {str(id): i for i, (id, _) in enumerate(sessions)}
+        self._rows: dict[int, int] = {}
+        self._states = bytearray()
+        self._counts: dict[AttendanceOptions, array] = {
+            option: array("H") for option in AttendanceOptions
+        }
+        self._aggregates: dict[int, AttendanceProportion] = {}
+
+    def _row(self, student_id: int) -> int:
+        row = self._rows.get(student_id)
+        if row is None:
+            row = self._rows[student_id] = len(self.student_ids)
+            self.student_ids.append(student_id)
+            self._states.extend(bytes([_NOT_RECORDED]) * len(self.sessions))
+            for counts in self._counts.values():
+                counts.append(0)
+
+        return row
+
+    def set(
+        self, student_id: int, session_id: int | str, option: AttendanceOptions
+    ) -> None:
+        row = self._row(student_id)
+        i = row * len(self.sessions) + self._columns[str(session_id)]
+
+        if self._states[i] != _NOT_RECORDED:
+            old_option = AttendanceOptions(self._states[i])
+            self._counts[old_option][row] -= 1
+        else:
+            # Top Hat counts a session with no record as an absence.
+            old_option = AttendanceOptions.ABSENT
+        self._states[i] = option.value
+        self._counts[option][row] += 1
+
+        if student_id in self._aggregates:
+            attended, total = self._aggregates[student_id]
+            attended += _attended(option) - _attended(old_option)
+            total += _counted(option) - _counted(old_option)
+            self._aggregates[student_id] = (attended, total)
+
+    def get(self, student_id: int, session_id: int | str) -> AttendanceOptions | None:
+        row = self._rows.get(student_id)
+        column = self._columns.get(str(session_id))
+        if row is None or column is None:
+            return None
+
+        state = self._states[row * len(self.sessions) + column]
+        return None if state == _NOT_RECORDED else AttendanceOptions(state)
+
+    def add_gradebook_row(self, gradebook_row: dict) -> None:
+        """
+        Records a row from the `gradeable_items` feed, ignoring rows for
+        anything other than an attendance session or a student's attendance
+        aggregate.
+        """
+        item_id = str(gradebook_row.get("item_id"))
+        if item_id not in self._columns:
+            if "attendance" in item_id:
+                self._row(gradebook_row["student_id"])
+                self._aggregates[gradebook_row["student_id"]] = (
+                    gradebook_row["weighted_correctness"],
+                    gradebook_row["correctness_weight"],
+                )
+            return
+
+        if gradebook_row["grade_type"] == "excused":
+            option = AttendanceOptions.EXCUSED
+        elif gradebook_row["weighted_correctness"] == 1:
+            option = AttendanceOptions.PRESENT
+        else:
+            option = AttendanceOptions.ABSENT
+
+        self.set(gradebook_row["student_id"], gradebook_row["item_id"], option)
+
+    def count(self, student_id: int, option: AttendanceOptions) -> int:
+        row = self._rows.get(student_id)
+        return 0 if row is None else self._counts[option][row]
+
+    def counted_proportion(self, student_id: int) -> AttendanceProportion:
+        """
+        Counts (sessions attended, sessions counted) from the per-session
+        records. As in Top Hat, excused sessions are not counted and
+        sessions with no record count as absences.
+        """
+        attended = self.count(student_id, AttendanceOptions.PRESENT)
+        excused = self.count(student_id, AttendanceOptions.EXCUSED)
+
+        return (attended, len(self.sessions) - excused)
+
+    def aggregate(self, student_id: int) -> AttendanceProportion | None:
+        """
+        Returns (sessions attended, sessions counted) from Top Hat's
+        aggregate row, or None if the feed had none for the student.
+        """
+        return self._aggregates.get(student_id)
+
+    def proportion(self, student_id: int) -> AttendanceProportion:
+        """
+        Returns the student's `aggregate`, or their `counted_proportion` if
+        the feed had no aggregate row for them.
+        """
+        aggregate = self.aggregate(student_id)
+        if aggregate is not None:
+            return aggregate
+
+        return self.counted_proportion(student_id)
+
+    def proportions(self) -> dict[int, AttendanceProportion]:
+        return {student_id: self.proportion(student_id) for student_id in self._rows}
+
+    def records_for(self, student_id: int) -> list[dict]:
+        row = self._rows.get(student_id)
+        if row is None:
+            return []
+
+        offset = row * len(self.sessions)
+        attendance_records = []
+        for column, (id, date_taken) in enumerate(self.sessions):
+            state = self._states[offset + column]
+            if state == _NOT_RECORDED:
+                continue
+
+            attendance_records.append(
+                {
+                    "date_taken": date_taken,
+                    "attended": state == AttendanceOptions.PRESENT.value,
+                    "excused": state == AttendanceOptions.EXCUSED.value,
+                    "id": id,
+                }
+            )
+
+        return attendance_records
 
 
-def _find_attendance_item_in_attendance_gradebook_data(
-    attendance_gradebook_data: list[dict], attendance_item_id: int | str
-) -> AttendanceItem:
+def get_attendance_matrix(
+    course: Course, client: TopHatClient, student_ids: Optional[list[int]] = None
+) -> AttendanceMatrix:
     """
-    This function facilitates searching data from the attendance gradebook endpoint by the ID provided by the attendance answers endpoint.
+    Builds the course's attendance matrix from its session list and one
+    pass over the `gradeable_items` feed.
+
+    Parameters
+    ----------
+    `student_ids`: Optional[list[int]]
+        Only fetch the gradebook rows for these students. By default, every
+        student in the course is included.
     """
-    attendance_item_id = str(attendance_item_id)
+    course_id = course["course_id"]
+    sessions = []
+    for name, id in _get_th_attendance_item_names_and_ids(course, client):
+        date_taken_str = name[:10]  # Strip off the time
+        sessions.append((id, datetime.strptime(date_taken_str, "%Y-%m-%d").date()))
 
-    for attendance_gradebook_entry in attendance_gradebook_data:
-        if "item_id" not in attendance_gradebook_entry:
-            continue
+    matrix = AttendanceMatrix(sessions)
 
-        entry_item_id = attendance_gradebook_entry["item_id"]
-        if entry_item_id == attendance_item_id:
-            return attendance_gradebook_entry
+    params = {}
+    if student_ids:
+        params["student_ids"] = ",".join(str(id) for id in student_ids)
 
-    return {}
+    gradeable_items = TopHatPaginatedList(
+        client,
+        f"/api/gradebook/v1/gradeable_items/{course_id}/",
+        params=params,
+        root="results",
+        paged=True,
+        timeout=cs.TH_GRADEBOOK_TIMEOUT_SECS,
+    )
+    for result in gradeable_items:
+        matrix.add_gradebook_row(result)
+
+    return matrix
 
 
 def get_attendance_records_for_student_in_course(
-    course: Course, student: Student, auth_header: AuthHeader
+    course: Course, student: Student, client: TopHatClient
 ) -> list[dict]:
-    attendance_item_names_and_ids = _get_th_attendance_item_names_and_ids(
-        course, auth_header
-    )
-    attendance_gradebook_data = _get_attendance_gradebook_data(
-        course, student, auth_header
-    )
+    matrix = get_attendance_matrix(course, client, student_ids=[student["id"]])
+    return matrix.records_for(student["id"])
 
-    attendance_records = []
-    for name, id in attendance_item_names_and_ids:
-        attendance_item = _find_attendance_item_in_attendance_gradebook_data(
-            attendance_gradebook_data, id
-        )
-        if not attendance_item:
-            continue
 
-        date_taken_str = name[:10]  # Strip off the time
-        date_taken = datetime.strptime(date_taken_str, "%Y-%m-%d").date()
-
-        attended = attendance_item["weighted_correctness"] == 1
-        excused = attendance_item["grade_type"] == "excused"
-
-        attendance_records.append(
-            {
-                "date_taken": date_taken,
-                "attended": attended,
-                "excused": excused,
-                "id": id,
-            }
-        )
+class AttendanceEdit(NamedTuple):
+    student_id: int
+    attendance_id: int
+    new_attendance: AttendanceOptions
 
-    return attendance_records
 
-
-def edit_attendance(
+def _post_attendance_edit(
+    client: TopHatClient,
     course_id: int,
     student_id: int,
     attendance_id: int,
     new_attendance: AttendanceOptions,
-    auth_header: AuthHeader,
 ) -> None:
     if type(new_attendance) is not AttendanceOptions:
         raise TypeError(
@@ -300,7 +794,9 @@ def edit_attendance(
         attended = False
         excused = True
 
-    edit_attendance_url = f"https://app.tophat.com/api/gradebook/v1/gradeable_items/{course_id}/edit/{attendance_id}/"
+    edit_attendance_url = (
+        f"/api/gradebook/v1/gradeable_items/{course_id}/edit/{attendance_id}/"
+    )
     edit_attendance_data = {
         "student_id": student_id,
         "weighted_correctness": 1 if attended else 0,
@@ -311,39 +807,99 @@ def edit_attendance(
         "is_manual_entry": False,
         "return_tree_type": "selective",
     }
-    response = requests.post(
-        url=edit_attendance_url, json=edit_attendance_data, headers=auth_header
+    # The edit sets the record outright, so sending it twice is harmless.
+    client.request(
+        "POST", edit_attendance_url, json=edit_attendance_data, idempotent=True
     )
-    response.raise_for_status()
+
+
+def edit_attendance(
+    course_id: int,
+    student_id: int,
+    attendance_id: int,
+    new_attendance: AttendanceOptions,
+    client: TopHatClient,
+) -> None:
+    _post_attendance_edit(client, course_id, student_id, attendance_id, new_attendance)
 
     print("Successfully modified attendance!")
 
 
-def get_active_attendance(auth_header: AuthHeader, course_id: int):
-    active_attendance_url = f"https://app.tophat.com/api/v3/attendance/get_active_attendance/?course_id={course_id}"
+def edit_attendance_in_bulk(
+    client: TopHatClient,
+    course_id: int,
+    edits: list[AttendanceEdit],
+    matrix: Optional[AttendanceMatrix] = None,
+    max_workers=cs.MAX_WORKERS,
+) -> list[FanOutResult]:
+    """
+    Posts many attendance edits at once, printing the progress and
+    throughput as they finish.
+
+    Parameters
+    ----------
+    `edits`: list[AttendanceEdit]
+        The (student, session, option) edits to make.
+
+    `matrix`: Optional[AttendanceMatrix]
+        If given, each edit is written through to it once Top Hat accepts
+        it, so the matrix stays current without being downloaded again.
+
+    `max_workers`: int
+        The most edits to have in flight at once. Each edit is retried
+        under `retry.TH_POLICY`.
+
+    Returns
+    -------
+    list[FanOutResult]
+        One result per edit, with `error` set for any that failed.
+    """
+    lock = threading.Lock()
+    start = time.monotonic()
+    finished = 0
 
-    active_attendance_response = requests.get(
-        active_attendance_url, headers=auth_header
-    )
-    active_attendance_response.raise_for_status()
+    def post(edit: AttendanceEdit) -> None:
+        nonlocal finished
+
+        _post_attendance_edit(client, course_id, *edit)
+
+        with lock:
+            if matrix:
+                matrix.set(*edit)
 
-    return active_attendance_response.json()
+            finished += 1
+            rate = finished / max(time.monotonic() - start, 1e-9)
+            print(
+                f"\r    Edited {finished}/{len(edits)} records ({rate:.1f}/s)",
+                end="",
+                flush=True,
+            )
+
+    results = fan_out(edits, post, max_workers=max_workers, timeout=None)
+    print()
+
+    return results
+
+
+def get_active_attendance(client: TopHatClient, course_id: int):
+    return client.get(
+        "/api/v3/attendance/get_active_attendance/", params={"course_id": course_id}
+    )
 
 
 def create_attendance(
-    auth_header: AuthHeader, course_id: int, attempt_limit=3, start_securely=False
+    client: TopHatClient, course_id: int, attempt_limit=3, start_securely=False
 ) -> tuple[dict, bool]:
-    active_attendance = get_active_attendance(auth_header, course_id)
+    active_attendance = get_active_attendance(client, course_id)
     if active_attendance:
         active_attendance_id = active_attendance[0]["id"]
 
-        attendance_item = get_attendance_item(auth_header, active_attendance_id)
+        attendance_item = get_attendance_item(client, active_attendance_id)
         attendance_code = attendance_item["code"]
 
         print(f"Attendance already exists; the code is {attendance_code}")
         return attendance_item, False
 
-    create_attendance_url = "https://app.tophat.com/api/v2/attendance/"
     create_attendance_payload = {
         "answered": False,
         "attempt_limit": attempt_limit,
@@ -352,13 +908,10 @@ def create_attendance(
         "module": "attendance",
         "start_securely": start_securely,
     }
-    auth_header["Course-Id"] = str(course_id)
 
-    create_attendance_response = requests.post(
-        create_attendance_url, json=create_attendance_payload, headers=auth_header
+    create_attendance_data = client.post(
+        "/api/v2/attendance/", json=create_attendance_payload, course_id=course_id
     )
-    create_attendance_response.raise_for_status()
-    create_attendance_data = create_attendance_response.json()
 
     attendance_code = create_attendance_data["code"]
 
@@ -367,32 +920,50 @@ def create_attendance(
 
 
 def monitor_attendance(
-    auth_header: AuthHeader, course_id: int, attendance_item_id: int
+    client: TopHatClient, course_id: int, attendance_item_id: int
 ) -> tuple[int, int]:
-    attendance_monitoring_url = f"https://app.tophat.com/api/gradebook/v1/gradeable_items/{course_id}/item/{attendance_item_id}/metadata/"
-    attendance_monitoring_response = requests.get(
-        attendance_monitoring_url, headers=auth_header
+    attendance_monitoring_data = client.get(
+        f"/api/gradebook/v1/gradeable_items/{course_id}/item/{attendance_item_id}/metadata/"
     )
-    attendance_monitoring_response.raise_for_status()
-
-    attendance_monitoring_data = attendance_monitoring_response.json()
     attended_students = attendance_monitoring_data["correct_answers_count"]
     total_students = attendance_monitoring_data["assigned_students_count"]
 
     return attended_students, total_students
 
 
-def close_attendance(auth_header: AuthHeader, course_id: int, attendance_item_id: int):
-    close_attendance_url = "https://app.tophat.com/api/v2/module_item_status/"
+def _post_close_attendance(
+    client: TopHatClient, course_id: int, attendance_item_id: int
+) -> None:
     close_attendance_payload = {
         "items": [attendance_item_id],
         "status": "inactive",
     }
-    auth_header["Course-Id"] = str(course_id)
 
-    close_attendance_response = requests.post(
-        close_attendance_url, json=close_attendance_payload, headers=auth_header
+    client.request(
+        "POST",
+        "/api/v2/module_item_status/",
+        json=close_attendance_payload,
+        course_id=course_id,
+        idempotent=True,
     )
-    close_attendance_response.raise_for_status()
+
+
+def close_attendance(client: TopHatClient, course_id: int, attendance_item_id: int):
+    _post_close_attendance(client, course_id, attendance_item_id)
 
     print(f"Attendance item {attendance_item_id} closed.")
+
+
+def close_attendance_in_bulk(
+    client: TopHatClient, course_and_item_ids: list[tuple[int, int]]
+) -> list[FanOutResult]:
+    """
+    Closes the attendance items, given as (course id, attendance item id)
+    pairs, all at once and without printing anything.
+    """
+    # A close still running at a timeout may yet succeed, so wait for each.
+    return fan_out(
+        course_and_item_ids,
+        lambda course_and_item_id: _post_close_attendance(client, *course_and_item_id),
+        timeout=None,
+    )
@@ -0,0 +1,86 @@
+from urllib.parse import urlencode
+
+from canvasapi.course import Course
+from canvasapi.requester import Requester
+
+import lugach.apps.identify_quiz_concerns as iqc
+import lugach.core.constants as cs
+
+STUDENT_IDS = [101, 102, 103]
+QUIZ_IDS = list(range(1001, 1021))
+# Student 101 missed every quiz and 102 missed one; 103 missed none.
+MISSED = {101: set(QUIZ_IDS), 102: {QUIZ_IDS[0]}, 103: set()}
+
+
+class FakeResponse:
+    links = {}
+    headers = {}
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeRequester(Requester):
+    """Answers the course's requests from fixtures, recording every URL."""
+
+    def __init__(self):
+        super().__init__("https://canvas.example.edu", "token")
+        self.urls = []
+
+    def request(self, method, endpoint=None, _url=None, _kwargs=None, **kwargs):
+        params = list(_kwargs or []) + list(kwargs.items())
+        self.urls.append(f"{self.base_url}{endpoint}?{urlencode(params)}")
+
+        if endpoint == "courses/1/search_users":
+            return FakeResponse(
+                [{"id": id, "name": f"Student {id}"} for id in STUDENT_IDS]
+            )
+        if endpoint == "courses/1/assignments":
+            return FakeResponse(
+                [
+                    {"id": id, "course_id": 1, "submission_types": ["online_quiz"]}
+                    for id in QUIZ_IDS
+                ]
+            )
+
+        quiz_id = int(endpoint.split("/")[3])
+        return FakeResponse(
+            [
+                {
+                    "id": quiz_id * 1000 + student_id,
+                    "assignment_id": quiz_id,
+                    "user_id": student_id,
+                    "missing": quiz_id in MISSED[student_id],
+                }
+                for student_id in STUDENT_IDS
+            ]
+        )
+
+
+def quiz_params_length() -> int:
+    return sum(len(f"&assignment_ids%5B%5D={id}") for id in QUIZ_IDS)
+
+
+def test_max_batch_size_is_zero_when_no_student_fits(monkeypatch):
+    course = Course(FakeRequester(), {"id": 1})
+    monkeypatch.setattr(cs, "MAX_URL_LENGTH", quiz_params_length())
+
+    assert iqc._max_batch_size_for_url(course, STUDENT_IDS, QUIZ_IDS) == 0
+
+
+def test_find_quiz_concern_students_falls_back_to_per_quiz_requests(monkeypatch):
+    requester = FakeRequester()
+    course = Course(requester, {"id": 1})
+    # Longer than any per-quiz URL, but too short for the batched one.
+    monkeypatch.setattr(cs, "MAX_URL_LENGTH", quiz_params_length())
+
+    quiz_concern_students = iqc.find_quiz_concern_students(course)
+
+    assert {
+        student.id: student.missed_quizzes for student in quiz_concern_students
+    } == {101: len(QUIZ_IDS)}
+    assert not any("students/submissions" in url for url in requester.urls)
+    assert all(len(url) <= cs.MAX_URL_LENGTH for url in requester.urls)
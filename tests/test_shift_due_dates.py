@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+
+from canvasapi.assignment import Assignment, AssignmentOverride
+from canvasapi.requester import Requester
+
+import lugach.apps.shift_due_dates as sdd
+
+COURSE_ID = 10
+
+
+class FakeCourse:
+    """Only the parts of a `Course` that `plan_shift` reads."""
+
+    id = COURSE_ID
+    time_zone = "America/New_York"
+
+    def __init__(self, assignments):
+        self._assignments = assignments
+
+    def get_quizzes(self):
+        return []
+
+    def get_assignments(self, **kwargs):
+        return self._assignments
+
+
+def make_assignment(requester: Requester) -> Assignment:
+    # Built by canvasapi, so `overrides` holds `AssignmentOverride` objects
+    # exactly as `get_assignments(include=["overrides"])` returns them.
+    return Assignment(
+        requester,
+        {
+            "id": 1,
+            "course_id": COURSE_ID,
+            "name": "Homework 1",
+            "is_quiz_assignment": False,
+            "due_at": "2025-03-07T04:59:00Z",
+            "overrides": [
+                {
+                    "id": 5,
+                    "assignment_id": 1,
+                    "title": "Section 2",
+                    "student_ids": [3],
+                    "due_at": "2025-03-08T04:59:00Z",
+                }
+            ],
+        },
+    )
+
+
+def plan(requester: Requester) -> list[dict]:
+    course = FakeCourse([make_assignment(requester)])
+    return sdd.plan_shift(
+        course,
+        datetime(2025, 3, 1, tzinfo=timezone.utc),
+        datetime(2025, 3, 31, tzinfo=timezone.utc),
+        days=7,
+    )
+
+
+def test_plan_shift_shifts_canvasapi_overrides_on_the_wall_clock():
+    requester = Requester("https://canvas.example.edu", "token")
+    assignment_change, override_change = plan(requester)
+
+    # 23:59 EST before the daylight saving change is 23:59 EDT after it.
+    assert assignment_change["dates"] == {
+        "due_at": ("2025-03-07T04:59:00Z", "2025-03-14T03:59:00+00:00")
+    }
+    assert isinstance(override_change["target"], AssignmentOverride)
+    assert override_change["name"] == "Homework 1 (Section 2)"
+    assert override_change["dates"] == {
+        "due_at": ("2025-03-08T04:59:00Z", "2025-03-15T03:59:00+00:00")
+    }
+
+
+def test_apply_change_edits_the_override_in_its_course(monkeypatch):
+    requester = Requester("https://canvas.example.edu", "token")
+    _, override_change = plan(requester)
+
+    calls = []
+
+    class FakeResponse:
+        def json(self):
+            return {"id": 5, "assignment_id": 1, "title": "Section 2"}
+
+    def request(method, endpoint, **kwargs):
+        calls.append((method, endpoint, dict(kwargs["_kwargs"])))
+        return FakeResponse()
+
+    monkeypatch.setattr(requester, "request", request)
+    sdd.apply_change(override_change)
+
+    [(method, endpoint, params)] = calls
+    assert (method, endpoint) == (
+        "PUT",
+        f"courses/{COURSE_ID}/assignments/1/overrides/5",
+    )
+    assert params["assignment_override[due_at]"] == "2025-03-15T03:59:00+00:00"
+    assert params["assignment_override[title]"] == "Section 2"
+    assert params["assignment_override[student_ids][]"] == 3